@@ -1,16 +1,56 @@
 import logging
+import multiprocessing as mp
+import os
 
+import numpy as np
 from tqdm import tqdm
 
+from MCTS import SearchMetrics
+
 log = logging.getLogger(__name__)
 
+# the Arena of an arena worker process, with the players built by makePlayers
+_worker = None
+
+
+def _initArenaWorker(game, makePlayers, seed):
+    global _worker
+    player1, player2, mcts1, mcts2 = makePlayers(game)
+    _worker = Arena(player1, player2, game, mcts1=mcts1, mcts2=mcts2)
+    np.random.seed((seed + os.getpid()) % (2 ** 32))
+
+
+def _arenaGame(swapped):
+    """
+    Plays one game in an arena worker process, started by player2 if
+    swapped, else by player1.
+
+    Returns:
+        gameResult: the result of the game for player1, see Arena.playGame
+        metrics1, metrics2: the SearchMetrics of the game of player 1,2, or
+                            None for a player without MCTS
+    """
+    for mcts in (_worker.mcts1, _worker.mcts2):
+        if mcts is not None:
+            mcts.totalMetrics = SearchMetrics()
+    if swapped:
+        _worker.player1, _worker.player2 = _worker.player2, _worker.player1
+        try:
+            gameResult = -_worker.playGame()
+        finally:
+            _worker.player1, _worker.player2 = _worker.player2, _worker.player1
+    else:
+        gameResult = _worker.playGame()
+    metrics1, metrics2 = [None if mcts is None else mcts.totalMetrics for mcts in (_worker.mcts1, _worker.mcts2)]
+    return gameResult, metrics1, metrics2
+
 
 class Arena():
     """
     An Arena class where any 2 agents can be pit against each other.
     """
 
-    def __init__(self, player1, player2, game, display=None):
+    def __init__(self, player1, player2, game, display=None, mcts1=None, mcts2=None, makePlayers=None):
         """
         Input:
             player 1,2: two functions that takes board as input, return action
@@ -18,6 +58,13 @@ class Arena():
             display: a function that takes board as input and prints it (e.g.
                      display in othello/OthelloGame). Is necessary for verbose
                      mode.
+            mcts 1,2: the MCTS used by player 1,2, if any. Their totalMetrics
+                      are logged at the end of playGames.
+            makePlayers: a picklable function of game returning
+                         (player1, player2, mcts1, mcts2), which playGames
+                         calls in every worker process to build the players
+                         there. The players may then be None, they are made
+                         with it too when the games are played here.
 
         see othello/OthelloPlayers.py for an example. See pit.py for pitting
         human players/other baselines with each other.
@@ -26,6 +73,9 @@ class Arena():
         self.player2 = player2
         self.game = game
         self.display = display
+        self.mcts1 = mcts1
+        self.mcts2 = mcts2
+        self.makePlayers = makePlayers
 
     def playGame(self, verbose=False):
         """
@@ -62,16 +112,28 @@ class Arena():
             self.display(board)
         return curPlayer * self.game.getGameEnded(board, curPlayer)
 
-    def playGames(self, num, verbose=False):
+    def playGames(self, num, verbose=False, numWorkers=1):
         """
         Plays num games in which player1 starts num/2 games and player2 starts
         num/2 games.
 
+        With numWorkers larger than 1 (and a makePlayers function), the games
+        are spread over that many worker processes, each holding its own
+        players built by makePlayers. They are started with the 'spawn'
+        method, see Coach.startSelfPlay. Verbose games are always played
+        here.
+
         Returns:
             oneWon: games won by player1
             twoWon: games won by player2
             draws:  games won by nobody
         """
+        if numWorkers > 1 and self.makePlayers is not None and not verbose:
+            return self.playGamesParallel(num, numWorkers)
+        if self.player1 is None:
+            self.player1, self.player2, self.mcts1, self.mcts2 = self.makePlayers(self.game)
+
+        searches = [('player1', self.mcts1), ('player2', self.mcts2)]
 
         num = int(num / 2)
         oneWon = 0
@@ -87,6 +149,7 @@ class Arena():
                 draws += 1
 
         self.player1, self.player2 = self.player2, self.player1
+        self.mcts1, self.mcts2 = self.mcts2, self.mcts1
 
         for _ in tqdm(range(num), desc="Arena.playGames (2)"):
             gameResult = self.playGame(verbose=verbose)
@@ -97,4 +160,47 @@ class Arena():
             else:
                 draws += 1
 
+        for name, mcts in searches:
+            if mcts is not None:
+                log.info(f'{name} search: {mcts.totalMetrics}')
+
+        return oneWon, twoWon, draws
+
+    def playGamesParallel(self, num, numWorkers):
+        """
+        Plays the games of playGames in numWorkers worker processes, handing
+        them out one at a time.
+
+        Returns:
+            oneWon, twoWon, draws: see playGames
+        """
+        num = int(num / 2)
+        oneWon = 0
+        twoWon = 0
+        draws = 0
+        searches = [('player1', SearchMetrics()), ('player2', SearchMetrics())]
+
+        context = mp.get_context('spawn')
+        pool = context.Pool(numWorkers, initializer=_initArenaWorker,
+                            initargs=(self.game, self.makePlayers, np.random.randint(2 ** 31)))
+        games = pool.imap_unordered(_arenaGame, [False] * num + [True] * num, chunksize=1)
+        try:
+            for gameResult, *metrics in tqdm(games, total=2 * num, desc="Arena.playGames"):
+                if gameResult == 1:
+                    oneWon += 1
+                elif gameResult == -1:
+                    twoWon += 1
+                else:
+                    draws += 1
+                for (_, total), gameMetrics in zip(searches, metrics):
+                    if gameMetrics is not None:
+                        total.add(gameMetrics)
+        finally:
+            pool.close()
+            pool.join()
+
+        for name, metrics in searches:
+            if metrics.searches > 0:
+                log.info(f'{name} search: {metrics}')
+
         return oneWon, twoWon, draws
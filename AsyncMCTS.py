@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import time
+
+import numpy as np
+
+from MCTS import MCTS
+from utils import encode_board
+
+log = logging.getLogger(__name__)
+
+
+class BatchEvaluator():
+    """
+    Evaluates the leaves of all searches running on one event loop together.
+
+    Every call to predict queues its board and waits for the result. The
+    queued boards are evaluated with a single nnet.predict_batch call as soon
+    as all searches that are ready to run have queued their leaf (or once
+    maxBatchSize boards are queued), and the waiting searches are resumed with
+    their results.
+    """
+
+    def __init__(self, nnet, maxBatchSize=None):
+        self.nnet = nnet
+        self.maxBatchSize = maxBatchSize
+        self.queue = []  # (board, future, metrics) waiting for evaluation
+        self.scheduled = False
+        self.numBatches = 0
+        self.numBoards = 0
+
+    async def predict(self, board, metrics=None):
+        """
+        Input:
+            board: an encoded board, as given to nnet.predict
+            metrics: the SearchMetrics of the search evaluating board. The
+                     network call of a batch is counted in the metrics of
+                     its first board, so that summing the metrics of all
+                     searches counts every call once.
+
+        Returns:
+            pi, v: the output of the network for board
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.queue.append((board, future, metrics))
+        if self.maxBatchSize and len(self.queue) >= self.maxBatchSize:
+            self.flush()
+        elif not self.scheduled:
+            # runs after every other coroutine that is ready had its turn
+            self.scheduled = True
+            loop.call_soon(self.flush)
+        return await future
+
+    def flush(self):
+        """
+        Evaluates all queued boards with one call to nnet.predict_batch.
+        """
+        self.scheduled = False
+        if not self.queue:
+            return
+        boards, futures, metrics = zip(*self.queue)
+        self.queue = []
+        self.numBatches += 1
+        if metrics[0] is not None:
+            metrics[0].networkCalls += 1
+        self.numBoards += len(boards)
+        try:
+            pis, vs = self.nnet.predict_batch(np.array(boards))
+        except Exception as e:
+            for future in futures:
+                if not future.cancelled():
+                    future.set_exception(e)
+            return
+        for future, pi, v in zip(futures, pis, vs):
+            if not future.cancelled():
+                future.set_result((pi, v))
+
+    def meanBatchSize(self):
+        return self.numBoards / self.numBatches if self.numBatches else 0
+
+
+class AsyncMCTS(MCTS):
+    """
+    An asyncio flavor of MCTS. Leaf evaluations await a BatchEvaluator, which
+    may be shared by many AsyncMCTS instances (e.g. several self-play games,
+    or all requests of a server) running on the same event loop, so that one
+    network call serves all of them.
+
+    Within one tree, args.leafBatchSize (default 1) searches run concurrently,
+    spread out by virtual loss of args.virtualLoss (default 1). A search that
+    reaches a leaf already being evaluated waits for its expansion and
+    descends again.
+    """
+
+    def __init__(self, game, nnet, args, evaluator=None):
+        super().__init__(game, nnet, args)
+        self.evaluator = evaluator if evaluator is not None else BatchEvaluator(nnet)
+        self.pending = {}  # leaf s -> future that is done once s is expanded
+
+    async def getActionProb(self, canonicalBoard, temp=1, timeBudgetMs=None, numSims=None):
+        """
+        See MCTS.getActionProb.
+
+        Returns:
+            probs: a policy vector where the probability of the ith action is
+                   proportional to N(s,a)**(1./temp)
+        """
+        budget = self._startBudget(canonicalBoard, temp, timeBudgetMs, numSims)
+        s = self.hashKey(canonicalBoard)
+        if self.args.get('dirichletAlpha'):
+            if s not in self.nodes and budget.numSims > 0:
+                # expand the root first
+                await self.search(canonicalBoard)
+                budget.sims += 1
+            self._addRootNoise(s)
+
+        concurrency = self.args.get('leafBatchSize', 1)
+        while not budget.isDone(self, s):
+            sims = min(concurrency, budget.numSims - budget.sims)
+            await asyncio.gather(*[self.search(canonicalBoard) for _ in range(sims)])
+            budget.sims += sims
+
+        self._finishBudget(budget)
+        return self._getProbs(canonicalBoard, temp)
+
+    async def search(self, canonicalBoard):
+        """
+        This function performs one iteration of MCTS, see MCTS.search. Several
+        searches may run concurrently on the same tree.
+
+        Returns:
+            v: the negative of the value of the current canonicalBoard
+        """
+        virtualLoss = self.args.get('virtualLoss', 1)
+        self.stamp += 1
+        while True:
+            path, s, board, v = self._descend(canonicalBoard, virtualLoss)
+            if v is not None or s not in self.pending:
+                break
+            # another search is evaluating this leaf
+            self._revertVirtualLoss(path, virtualLoss)
+            await self.pending[s]
+
+        if v is None:
+            v = self._expandCached(s)
+        if v is None:
+            # leaf node
+            expanded = asyncio.get_running_loop().create_future()
+            self.pending[s] = expanded
+            try:
+                clock = time.perf_counter()
+                pi, v = await self.evaluator.predict(encode_board(board), self.metrics)
+                # the evaluator counts the batched network call, count this board and its waiting time only
+                self.metrics.networkBoards += 1
+                self.metrics.networkTime += time.perf_counter() - clock
+                v = self._expand(s, board, pi, v)
+            except BaseException:
+                self._revertVirtualLoss(path, virtualLoss)
+                raise
+            finally:
+                del self.pending[s]
+                expanded.set_result(None)
+
+        v = self._backup(path, v, virtualLoss)
+        self._evict()
+        return -v
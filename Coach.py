@@ -1,19 +1,74 @@
+import asyncio
+import functools
 import logging
+import multiprocessing as mp
 import os
 import sys
 from collections import deque
-from pickle import Pickler, Unpickler
-from random import shuffle
+from pickle import Unpickler
 
 import numpy as np
 from tqdm import tqdm
 
 from Arena import Arena
-from MCTS import MCTS
+from AsyncMCTS import AsyncMCTS, BatchEvaluator
+from ExampleShards import ExampleShards
+from MCTS import MCTS, SearchMetrics
+from ParallelMCTS import RootParallelMCTS
+from ReplayBuffer import ReplayBuffer
 from utils import encode_board
 
 log = logging.getLogger(__name__)
 
+# the Coach of a self-play worker process, and the shared number of the latest published model
+_worker = None
+_published = None
+
+
+def _initSelfPlayWorker(game, nnetClass, args, published, seed):
+    global _worker, _published
+    _worker = Coach(game, nnetClass(game), args)
+    _worker.loadedModel = 0
+    _published = published
+    np.random.seed((seed + os.getpid()) % (2 ** 32))
+
+
+def _selfPlayEpisode(_):
+    """
+    Plays one episode of self-play in a worker process, with the latest
+    model published by Coach.publishModel, which is loaded first if it is
+    new.
+
+    Returns:
+        trainExamples: the examples of the episode, see Coach.executeEpisode
+        metrics: the SearchMetrics of the episode
+    """
+    model = _published.value
+    if _worker.loadedModel != model:
+        _worker.nnet.load_checkpoint(folder=_worker.args.checkpoint, filename=_worker.getPublishedFile(model))
+        _worker.loadedModel = model
+    _worker.mcts = MCTS(_worker.game, _worker.nnet, _worker.args)
+    return _worker.executeEpisode(), _worker.mcts.totalMetrics
+
+
+def _arenaPlayers(game, nnetClass, args, filenames):
+    """
+    Builds the arena players of an arena worker process: each loads the
+    network checkpoint of one of filenames in args.checkpoint and plays the
+    most visited move of a plain MCTS.
+
+    Returns:
+        player1, player2, mcts1, mcts2: see Arena
+    """
+    players, searches = [], []
+    for filename in filenames:
+        nnet = nnetClass(game)
+        nnet.load_checkpoint(folder=args.checkpoint, filename=filename)
+        mcts = MCTS(game, nnet, args)
+        players.append(lambda x, mcts=mcts: np.argmax(mcts.getActionProb(x, temp=0)))
+        searches.append(mcts)
+    return players[0], players[1], searches[0], searches[1]
+
 
 class Coach():
     """
@@ -24,11 +79,18 @@ class Coach():
     def __init__(self, game, nnet, args):
         self.game = game
         self.nnet = nnet
-        self.pnet = self.nnet.__class__(self.game)  # the competitor network
+        self.pnet = None  # the competitor network, created by learn
         self.args = args
         self.mcts = MCTS(self.game, self.nnet, self.args)
-        self.trainExamplesHistory = []  # history of examples from args.numItersForTrainExamplesHistory latest iterations
+        # history of examples from args.numItersForTrainExamplesHistory latest iterations
+        capacity = self.args.get('replayBufferSize', self.args.get('maxlenOfQueue', 200000))
+        self.trainExamplesHistory = ReplayBuffer(capacity, window=self.args.get('numItersForTrainExamplesHistory'),
+                                                 game=self.game if self.args.get('sampleSymmetries') else None,
+                                                 compact=self.args.get('compactExamples', False))
         self.skipFirstSelfPlay = False  # can be overriden in loadTrainExamples()
+        self.selfPlayMetrics = SearchMetrics()  # search metrics of the self-play of the latest iteration
+        self.selfPlayPool = None  # worker processes of startSelfPlay
+        self.publishedModel = None  # number of the latest model published to them, shared with them
 
     def executeEpisode(self):
         """
@@ -41,33 +103,195 @@ class Coach():
         It uses a temp=1 if episodeStep < tempThreshold, and thereafter
         uses temp=0.
 
+        With playout cap randomization (args.playoutCapProb below 1), only a
+        random playoutCapProb fraction of the moves runs the full numMCTSSims
+        search and is added to trainExamples. The other moves are played
+        after a fast search of args.numMCTSSimsFast simulations and are not
+        recorded, since their visit counts are too noisy a policy target.
+
+        Every recorded move adds the examples of all symmetrical forms of the
+        board given by game.getSymmetries, or, with args.sampleSymmetries,
+        only the example of the board itself; the replay buffer then applies
+        the symmetries when the examples are sampled for training.
+
         Returns:
             trainExamples: a list of examples of the form (canonicalBoard, currPlayer, pi,v)
                            pi is the MCTS informed policy vector, v is +1 if
                            the player eventually won the game, else -1.
         """
+        episode = self.playEpisode()
+        request = next(episode)
+        while True:
+            canonicalBoard, temp, numSims = request
+            pi = self.mcts.getActionProb(canonicalBoard, temp=temp, numSims=numSims)
+            try:
+                request = episode.send(pi)
+            except StopIteration as done:
+                return done.value
+
+    async def executeEpisodeAsync(self, mcts):
+        """
+        The asyncio flavor of executeEpisode, searching with mcts, an
+        AsyncMCTS.
+
+        Returns:
+            trainExamples: see executeEpisode
+        """
+        episode = self.playEpisode()
+        request = next(episode)
+        while True:
+            canonicalBoard, temp, numSims = request
+            pi = await mcts.getActionProb(canonicalBoard, temp=temp, numSims=numSims)
+            try:
+                request = episode.send(pi)
+            except StopIteration as done:
+                return done.value
+
+    def playEpisode(self):
+        """
+        A generator playing one episode of self-play as described in
+        executeEpisode, leaving the search to its caller. For every move it
+        yields (canonicalBoard, temp, numSims) and expects to be sent the
+        policy found by searching canonicalBoard with these arguments.
+
+        Returns:
+            trainExamples: see executeEpisode, as the value of StopIteration
+        """
         trainExamples = []
         board = self.game.getInitBoard()
-        self.curPlayer = 1
+        curPlayer = 1
         episodeStep = 0
 
         while True:
             episodeStep += 1
-            canonicalBoard = self.game.getCanonicalForm(board, self.curPlayer)
+            canonicalBoard = self.game.getCanonicalForm(board, curPlayer)
             temp = int(episodeStep < self.args.tempThreshold)
 
-            pi = self.mcts.getActionProb(canonicalBoard, temp=temp)
-            sym = self.game.getSymmetries(canonicalBoard, pi)
-            for b, p in sym:
-                trainExamples.append([encode_board(b), self.curPlayer, p, None])
+            fullSearch = np.random.random() < self.args.get('playoutCapProb', 1)
+            numSims = None if fullSearch else self.args.get('numMCTSSimsFast')
+            pi = yield canonicalBoard, temp, numSims
+            if fullSearch:
+                sym = [(canonicalBoard, pi)] if self.args.get('sampleSymmetries') else \
+                    self.game.getSymmetries(canonicalBoard, pi)
+                for b, p in sym:
+                    trainExamples.append([encode_board(b), curPlayer, p, None])
 
             action = np.random.choice(len(pi), p=pi)
-            board, self.curPlayer = self.game.getNextState(board, self.curPlayer, action)
+            board, curPlayer = self.game.getNextState(board, curPlayer, action)
 
-            r = self.game.getGameEnded(board, self.curPlayer)
+            r = self.game.getGameEnded(board, curPlayer)
 
             if r != 0:
-                return [(x[0], x[2], r * ((-1) ** (x[1] != self.curPlayer))) for x in trainExamples]
+                return [(x[0], x[2], r * ((-1) ** (x[1] != curPlayer))) for x in trainExamples]
+
+    def executeEpisodesLockstep(self, numEps):
+        """
+        Plays numEps episodes of self-play, keeping args.selfPlayBatchSize of
+        them in play at the same time. Every game searches its own AsyncMCTS
+        tree, and all trees share one BatchEvaluator: whenever every game has
+        reached a leaf (args.leafBatchSize leaves per game), the leaves of all
+        games are evaluated with a single batched network call. A new episode
+        starts as soon as one ends, so the batch stays full.
+
+        Returns:
+            trainExamples: the examples of all episodes, see executeEpisode
+        """
+        return asyncio.run(self._executeEpisodesLockstep(numEps))
+
+    def executeEpisodesParallel(self, numEps):
+        """
+        Plays numEps episodes of self-play in args.numSelfPlayWorkers worker
+        processes, see startSelfPlay.
+
+        Returns:
+            trainExamples: the examples of all episodes, see executeEpisode
+        """
+        return self.collectSelfPlay(self.startSelfPlay(numEps), numEps)
+
+    def startSelfPlay(self, numEps):
+        """
+        Starts numEps episodes of self-play in args.numSelfPlayWorkers worker
+        processes and returns without waiting for them. Every worker plays
+        with the latest model published by publishModel, which it loads
+        between two episodes; the current network is published first if no
+        model was published yet. The episodes are handed out one at a time,
+        so that workers finishing short games pick up the next one, and the
+        examples of every episode are passed back as soon as it ends.
+
+        The workers are started with the 'spawn' method on first use, so the
+        script using them must guard its top level with
+        if __name__ == "__main__" (as main.py does). Call closeSelfPlay() to
+        stop them.
+
+        Returns:
+            episodes: the running episodes, to be passed to collectSelfPlay
+        """
+        if self.selfPlayPool is None:
+            context = mp.get_context('spawn')
+            self.publishedModel = context.Value('i', 0)
+            self.selfPlayPool = context.Pool(self.args.numSelfPlayWorkers, initializer=_initSelfPlayWorker,
+                                             initargs=(self.game, self.nnet.__class__, self.args,
+                                                       self.publishedModel, np.random.randint(2 ** 31)))
+        if self.publishedModel.value == 0:
+            self.publishModel()
+        return self.selfPlayPool.imap_unordered(_selfPlayEpisode, range(numEps), chunksize=1)
+
+    def collectSelfPlay(self, episodes, numEps):
+        """
+        Waits for the numEps episodes started by startSelfPlay, adding their
+        search metrics to self.selfPlayMetrics.
+
+        Returns:
+            trainExamples: the examples of all episodes, see executeEpisode
+        """
+        trainExamples = []
+        for examples, metrics in tqdm(episodes, total=numEps, desc="Self Play"):
+            trainExamples += examples
+            self.selfPlayMetrics.add(metrics)
+        return trainExamples
+
+    def publishModel(self):
+        """
+        Saves the current network to args.checkpoint as the next published
+        model, which the self-play workers load before their next episode.
+        The file of the model published before the previous one is removed,
+        no worker can be about to load it any more.
+        """
+        if self.selfPlayPool is None:
+            return
+        model = self.publishedModel.value + 1
+        self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=self.getPublishedFile(model))
+        self.publishedModel.value = model
+        old = os.path.join(self.args.checkpoint, self.getPublishedFile(model - 2))
+        if os.path.exists(old):
+            os.remove(old)
+
+    def getPublishedFile(self, model):
+        return 'selfplay_' + str(model) + '.pth.tar'
+
+    def closeSelfPlay(self):
+        if self.selfPlayPool is not None:
+            self.selfPlayPool.close()
+            self.selfPlayPool.join()
+            self.selfPlayPool = None
+
+    async def _executeEpisodesLockstep(self, numEps):
+        evaluator = BatchEvaluator(self.nnet)
+        episodes = iter(range(numEps))
+        trainExamples = []
+        progress = tqdm(total=numEps, desc="Self Play")
+
+        async def play():
+            for _ in episodes:
+                mcts = AsyncMCTS(self.game, self.nnet, self.args, evaluator)
+                trainExamples.extend(await self.executeEpisodeAsync(mcts))
+                self.selfPlayMetrics.add(mcts.totalMetrics)
+                progress.update()
+
+        await asyncio.gather(*[play() for _ in range(min(self.args.selfPlayBatchSize, numEps))])
+        progress.close()
+        log.info(f'Self play network batches: {evaluator.numBatches}, mean size {evaluator.meanBatchSize():.1f}')
+        return trainExamples
 
     def learn(self):
         """
@@ -76,7 +300,19 @@ class Coach():
         examples in trainExamples (which has a maximum length of maxlenofQueue).
         It then pits the new neural network against the old one and accepts it
         only if it wins >= updateThreshold fraction of games.
+
+        With args.dedupExamples, the examples of the same board are merged
+        into one before training, see ReplayBuffer.deduplicated, which is
+        weighed by the number of examples merged into it.
+
+        If args.pipelineSelfPlay is set (with args.numSelfPlayWorkers larger
+        than 1), the self-play episodes of the next iteration are started
+        before training, so that the workers keep playing while the network
+        is trained and pitted. They play with the latest accepted model,
+        which is published to them as soon as it is accepted.
         """
+        pipeline = self.args.get('pipelineSelfPlay', False) and self.args.get('numSelfPlayWorkers', 1) > 1
+        nextEpisodes = None  # self-play of the next iteration, started in the current one
 
         for i in range(1, self.args.numIters + 1):
             # bookkeeping
@@ -85,39 +321,46 @@ class Coach():
             if not self.skipFirstSelfPlay or i > 1:
                 iterationTrainExamples = deque([], maxlen=self.args.maxlenOfQueue)
 
-                for _ in tqdm(range(self.args.numEps), desc="Self Play"):
-                    self.mcts = MCTS(self.game, self.nnet, self.args)  # reset search tree
-                    iterationTrainExamples += self.executeEpisode()
+                self.selfPlayMetrics = SearchMetrics()
+                if nextEpisodes is not None:
+                    iterationTrainExamples += self.collectSelfPlay(nextEpisodes, self.args.numEps)
+                elif self.args.get('numSelfPlayWorkers', 1) > 1:
+                    iterationTrainExamples += self.executeEpisodesParallel(self.args.numEps)
+                elif self.args.get('selfPlayBatchSize', 1) > 1:
+                    iterationTrainExamples += self.executeEpisodesLockstep(self.args.numEps)
+                else:
+                    for _ in tqdm(range(self.args.numEps), desc="Self Play"):
+                        self.mcts = MCTS(self.game, self.nnet, self.args)  # reset search tree
+                        iterationTrainExamples += self.executeEpisode()
+                        self.selfPlayMetrics.add(self.mcts.totalMetrics)
+                log.info(f'Self play search: {self.selfPlayMetrics}')
+                if self.mcts.cache is not None:
+                    log.info(f'Evaluation cache: {self.mcts.cache}')
 
-                # save the iteration examples to the history 
-                self.trainExamplesHistory.append(iterationTrainExamples)
+                # save the iteration examples to the history, dropping the iterations that fall out of it
+                self.trainExamplesHistory.addIteration(iterationTrainExamples)
 
-            if len(self.trainExamplesHistory) > self.args.numItersForTrainExamplesHistory:
-                log.warning(
-                    f"Removing the oldest entry in trainExamples. len(trainExamplesHistory) = {len(self.trainExamplesHistory)}")
-                self.trainExamplesHistory.pop(0)
-            # backup history to a file
-            # NB! the examples were collected using the model from the previous iteration, so (i-1)  
-            self.saveTrainExamples(i - 1)
+                # backup the iteration to a file
+                # NB! the examples were collected using the model from the previous iteration, so (i-1)
+                self.saveTrainExamples(i - 1)
 
-            # shuffle examples before training
-            trainExamples = []
-            for e in self.trainExamplesHistory:
-                trainExamples.extend(e)
-            shuffle(trainExamples)
+            # the workers play the next iteration during training and the arena
+            nextEpisodes = self.startSelfPlay(self.args.numEps) if pipeline and i < self.args.numIters else None
 
             # training new network, keeping a copy of the old one
+            if self.pnet is None:
+                self.pnet = self.nnet.__class__(self.game)
             self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
             self.pnet.load_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
-            pmcts = MCTS(self.game, self.pnet, self.args)
 
+            trainExamples = self.trainExamplesHistory
+            if self.args.get('dedupExamples', False):
+                trainExamples = trainExamples.deduplicated()
+                log.info(f'Merged {len(self.trainExamplesHistory)} examples into {len(trainExamples)} positions')
             self.nnet.train(trainExamples)
-            nmcts = MCTS(self.game, self.nnet, self.args)
 
             log.info('PITTING AGAINST PREVIOUS VERSION')
-            arena = Arena(lambda x: np.argmax(pmcts.getActionProb(x, temp=0)),
-                          lambda x: np.argmax(nmcts.getActionProb(x, temp=0)), self.game)
-            pwins, nwins, draws = arena.playGames(self.args.arenaCompare)
+            pwins, nwins, draws = self.pitNetworks()
 
             log.info('NEW/PREV WINS : %d / %d ; DRAWS : %d' % (nwins, pwins, draws))
             if pwins + nwins == 0 or float(nwins) / (pwins + nwins) < self.args.updateThreshold:
@@ -127,21 +370,85 @@ class Coach():
                 log.info('ACCEPTING NEW MODEL')
                 self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=self.getCheckpointFile(i))
                 self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='best.pth.tar')
+                self.publishModel()
+
+        self.closeSelfPlay()
+
+    def pitNetworks(self):
+        """
+        Plays args.arenaCompare arena games between self.pnet and self.nnet.
+        With args.numArenaWorkers larger than 1, the games are spread over
+        that many worker processes, which load both networks from
+        args.checkpoint (pnet from temp.pth.tar, nnet from arena.pth.tar)
+        and search with a plain MCTS.
+
+        Returns:
+            pwins, nwins, draws: see Arena.playGames
+        """
+        numWorkers = self.args.get('numArenaWorkers', 1)
+        if numWorkers > 1:
+            self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='arena.pth.tar')
+            makePlayers = functools.partial(_arenaPlayers, nnetClass=self.nnet.__class__, args=self.args,
+                                            filenames=('temp.pth.tar', 'arena.pth.tar'))
+            return Arena(None, None, self.game, makePlayers=makePlayers).playGames(self.args.arenaCompare,
+                                                                                   numWorkers=numWorkers)
+
+        pmcts = self.arenaMCTS(self.pnet)
+        nmcts = self.arenaMCTS(self.nnet)
+        arena = Arena(lambda x: np.argmax(pmcts.getActionProb(x, temp=0)),
+                      lambda x: np.argmax(nmcts.getActionProb(x, temp=0)), self.game,
+                      mcts1=pmcts, mcts2=nmcts)
+        results = arena.playGames(self.args.arenaCompare)
+        if isinstance(pmcts, RootParallelMCTS):
+            pmcts.close()
+            nmcts.close()
+        return results
+
+    def arenaMCTS(self, nnet):
+        """
+        Returns the MCTS used by nnet in the arena: a RootParallelMCTS if
+        args.numMCTSWorkers is larger than 1, else a plain MCTS.
+        """
+        if self.args.get('numMCTSWorkers', 1) > 1:
+            return RootParallelMCTS(self.game, nnet, self.args)
+        return MCTS(self.game, nnet, self.args)
 
     def getCheckpointFile(self, iteration):
         return 'checkpoint_' + str(iteration) + '.pth.tar'
 
     def saveTrainExamples(self, iteration):
-        folder = self.args.checkpoint
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-        filename = os.path.join(folder, self.getCheckpointFile(iteration) + ".examples")
-        with open(filename, "wb+") as f:
-            Pickler(f).dump(self.trainExamplesHistory)
-        f.closed
+        """
+        Appends the examples of the latest iteration of the history to the
+        example shards of args.checkpoint, see ExampleShards.
+        """
+        boards, pis, vs = self.trainExamplesHistory.latestIteration()
+        if boards is None:
+            boards, pis, vs = np.zeros((0,)), np.zeros((0,)), np.zeros((0,))
+        ExampleShards(self.args.checkpoint).append(boards, pis, vs, iteration)
 
     def loadTrainExamples(self):
-        modelFile = os.path.join(self.args.load_folder_file[0], self.args.load_folder_file[1])
+        """
+        Loads the example shards of the iterations of the history from the
+        folder of args.load_folder_file. Without shards there, it falls back
+        to the single pickled file of all examples that older versions saved
+        next to the model.
+
+        Shards loaded from another folder than args.checkpoint are copied
+        there, so that the shards saved next continue the loaded history.
+        """
+        folder = self.args.load_folder_file[0]
+        if ExampleShards.exists(folder):
+            log.info("Example shards found. Loading the latest %d...", self.args.numItersForTrainExamplesHistory)
+            shards = ExampleShards(folder)
+            shards.load(self.trainExamplesHistory, self.args.numItersForTrainExamplesHistory)
+            if os.path.abspath(folder) != os.path.abspath(self.args.checkpoint):
+                shards.copy(self.args.checkpoint, self.args.numItersForTrainExamplesHistory)
+            log.info('Loading done!')
+            # examples based on the model were already collected (loaded)
+            self.skipFirstSelfPlay = True
+            return
+
+        modelFile = os.path.join(folder, self.args.load_folder_file[1])
         examplesFile = modelFile + ".examples"
         if not os.path.isfile(examplesFile):
             log.warning(f'File "{examplesFile}" with trainExamples not found!')
@@ -151,7 +458,14 @@ class Coach():
         else:
             log.info("File with trainExamples found. Loading it...")
             with open(examplesFile, "rb") as f:
-                self.trainExamplesHistory = Unpickler(f).load()
+                history = Unpickler(f).load()
+            if isinstance(history, ReplayBuffer):
+                history.game = self.trainExamplesHistory.game
+                self.trainExamplesHistory = history
+            else:
+                # a list with the examples of every iteration, as saved before the replay buffer
+                for iterationTrainExamples in history:
+                    self.trainExamplesHistory.addIteration(list(iterationTrainExamples))
             log.info('Loading done!')
 
             # examples based on the model were already collected (loaded)
@@ -0,0 +1,69 @@
+import threading
+from collections import OrderedDict
+
+
+class EvalCache():
+    """
+    A least recently used cache of network evaluations, shared by the MCTS
+    instances of a process (see sharedCache). Entries are keyed by the board
+    key (game.hashKey) together with the modelVersion of the network, so that
+    evaluations of a network whose weights have since been trained or loaded
+    are never returned; they are simply evicted in time.
+
+    An entry holds what MCTS keeps of an evaluation: the valid actions, the
+    prior restricted to them and the value.
+    """
+
+    def __init__(self, maxSize):
+        self.maxSize = maxSize  # maximum number of entries
+        self.entries = OrderedDict()  # least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns:
+            entry: the entry stored under key, or None
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return '%d entries, %d hits / %d lookups (%.1f%%)' % (
+            len(self.entries), self.hits, self.hits + self.misses, 100 * self.hitRate())
+
+
+_shared = None
+
+
+def sharedCache(maxSize):
+    """
+    Returns the EvalCache of this process, created with maxSize entries on
+    the first call and grown to maxSize entries if a later call asks for more.
+    """
+    global _shared
+    if _shared is None:
+        _shared = EvalCache(maxSize)
+    _shared.maxSize = max(_shared.maxSize, maxSize)
+    return _shared
@@ -0,0 +1,90 @@
+"""
+Compact encodings of stacked training examples, used by ReplayBuffer and
+ExampleShards to store them.
+
+Ternary boards, whose squares are all -1, 0 or 1 (as the planes of
+encode_board), are bit-packed into one bitplane per player. Policies,
+which are zero for all but a few actions, are stored as the indices and
+values of their largest entries, width of them per example.
+"""
+
+import numpy as np
+
+CHUNK_SIZE = 4096  # examples decoded at a time, which bounds the temporary arrays
+
+
+def isTernary(boards):
+    return np.issubdtype(boards.dtype, np.integer) and np.all((boards >= -1) & (boards <= 1))
+
+
+def packBoards(boards):
+    """
+    Returns:
+        packed: uint8 array of shape (n, 2, ceil(squares / 8)), the bitplanes
+                of the squares holding 1 and of those holding -1
+    """
+    flat = boards.reshape(len(boards), -1)
+    return np.stack([np.packbits(flat == 1, axis=1), np.packbits(flat == -1, axis=1)], axis=1)
+
+
+def unpackBoards(packed, boardShape):
+    """
+    Returns:
+        boards: int8 array of shape (n,) + boardShape, see packBoards
+    """
+    squares = int(np.prod(boardShape))
+    planes = np.unpackbits(packed, axis=2, count=squares).view(np.int8)
+    return (planes[:, 0] - planes[:, 1]).reshape((len(packed),) + tuple(boardShape))
+
+
+def policyWidth(pis):
+    """
+    Returns:
+        width: the largest number of nonzero entries of a policy of pis
+    """
+    return int(np.count_nonzero(pis, axis=1).max()) if len(pis) > 0 else 0
+
+
+def sparsePolicies(pis, width, valueDtype=np.float16):
+    """
+    Returns:
+        indices, values: arrays of shape (n, width), the actions and
+                         probabilities of the width largest entries of every
+                         policy, which are all of its nonzero entries if
+                         width is at least policyWidth(pis)
+    """
+    width = max(width, 1)
+    if width >= pis.shape[1]:
+        indices = np.broadcast_to(np.arange(pis.shape[1]), pis.shape)
+    else:
+        indices = np.argpartition(-pis, width - 1, axis=1)[:, :width]
+    values = np.take_along_axis(pis, indices, axis=1)
+    return indices.astype(indexDtype(pis.shape[1])), values.astype(valueDtype)
+
+
+def densePolicies(indices, values, actionSize, dtype=np.float32):
+    """
+    Returns:
+        pis: array of dtype and shape (n, actionSize), see sparsePolicies.
+             Only nonzero values are written, so columns padded with value 0
+             may repeat any index.
+    """
+    pis = np.zeros((len(indices), actionSize), dtype=dtype)
+    for start in range(0, len(indices), CHUNK_SIZE):
+        addPolicies(pis[start:start + CHUNK_SIZE], np.arange(min(CHUNK_SIZE, len(indices) - start)),
+                    indices[start:start + CHUNK_SIZE], values[start:start + CHUNK_SIZE])
+    return pis
+
+
+def addPolicies(pis, rows, indices, values):
+    """
+    Adds the sparse policies indices, values (see sparsePolicies) to the rows
+    of pis, several of them to the same row if rows repeat.
+    """
+    nonzero = values != 0
+    rows = np.broadcast_to(np.reshape(rows, (-1, 1)), indices.shape)
+    np.add.at(pis, (rows[nonzero], indices[nonzero].astype(np.intp)), values[nonzero].astype(pis.dtype))
+
+
+def indexDtype(actionSize):
+    return np.uint16 if actionSize <= np.iinfo(np.uint16).max + 1 else np.int32
@@ -0,0 +1,113 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from ExampleCodec import CHUNK_SIZE, densePolicies, isTernary, packBoards, policyWidth, sparsePolicies, unpackBoards
+
+MANIFEST = 'examples.json'
+
+
+class ExampleShards():
+    """
+    Training examples persisted to a folder as one shard per iteration of
+    self-play. A shard is an uncompressed .npz file holding the boards, pis
+    and vs arrays of the iteration, with ternary boards bit-packed and their
+    policies stored sparse (see ExampleCodec). A small JSON manifest lists
+    the shards, oldest first. Saving an iteration only writes its own shard
+    and rewrites the manifest, so the cost does not grow with the history.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.shards = []  # manifest entries {'file', 'iteration', 'size'}, oldest first
+        manifestFile = os.path.join(folder, MANIFEST)
+        if os.path.isfile(manifestFile):
+            with open(manifestFile) as f:
+                self.shards = json.load(f)['shards']
+
+    @staticmethod
+    def exists(folder):
+        return os.path.isfile(os.path.join(folder, MANIFEST))
+
+    def append(self, boards, pis, vs, iteration):
+        """
+        Writes the examples of an iteration as a new shard.
+
+        Input:
+            boards, pis, vs: stacked arrays of the examples
+            iteration: the iteration of the model that played them, only
+                       recorded in the manifest
+        """
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        # numbered by position, iterations restart from 1 when a run is resumed
+        filename = 'examples_' + str(len(self.shards)) + '.npz'
+        if len(boards) > 0 and isTernary(boards) and pis.ndim == 2:
+            piIndices, piValues = sparsePolicies(pis, policyWidth(pis))
+            arrays = dict(packedBoards=packBoards(boards), boardShape=np.array(boards.shape[1:]),
+                          piIndices=piIndices, piValues=piValues, actionSize=np.array(pis.shape[1]), vs=vs)
+        else:
+            arrays = dict(boards=boards, pis=pis, vs=vs)
+        self._replace(filename, lambda f: np.savez(f, **arrays))
+        self.shards.append({'file': filename, 'iteration': iteration, 'size': len(boards)})
+        self._writeManifest()
+
+    def load(self, replayBuffer, numShards=None):
+        """
+        Adds the examples of the latest numShards shards (all if None) to
+        replayBuffer, one iteration per shard. Older shards are not read.
+        """
+        for shard in self._latest(numShards):
+            with np.load(os.path.join(self.folder, shard['file'])) as data:
+                replayBuffer.addIteration([])
+                if shard['size'] == 0:
+                    continue
+                if 'packedBoards' in data:
+                    packedBoards, piIndices, piValues, vs = \
+                        data['packedBoards'], data['piIndices'], data['piValues'], data['vs']
+                    for start in range(0, len(vs), CHUNK_SIZE):
+                        chunk = slice(start, start + CHUNK_SIZE)
+                        replayBuffer.add(unpackBoards(packedBoards[chunk], tuple(data['boardShape'])),
+                                         densePolicies(piIndices[chunk], piValues[chunk], int(data['actionSize'])),
+                                         vs[chunk])
+                else:
+                    replayBuffer.add(data['boards'], data['pis'], data['vs'])
+
+    def copy(self, folder, numShards=None):
+        """
+        Copies the latest numShards shards (all if None) to folder, in place
+        of the shards held there, so that the shards appended to folder next
+        continue this history.
+
+        Returns:
+            shards: the ExampleShards of folder
+        """
+        copy = ExampleShards(folder)
+        copy.shards = []
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        for shard in self._latest(numShards):
+            filename = 'examples_' + str(len(copy.shards)) + '.npz'
+            with open(os.path.join(self.folder, shard['file']), 'rb') as source:
+                copy._replace(filename, lambda f: shutil.copyfileobj(source, f))
+            copy.shards.append(dict(shard, file=filename))
+        copy._writeManifest()
+        return copy
+
+    def _latest(self, numShards):
+        return self.shards if numShards is None else self.shards[max(len(self.shards) - numShards, 0):]
+
+    def _writeManifest(self):
+        self._replace(MANIFEST, lambda f: f.write(json.dumps({'shards': self.shards}, indent=1).encode()))
+
+    def _replace(self, filename, write):
+        # write to a temporary file first, so that an interrupted save never leaves a truncated file
+        path = os.path.join(self.folder, filename)
+        with open(path + '.tmp', 'wb') as f:
+            write(f)
+        os.replace(path + '.tmp', path)
+
+    def __len__(self):
+        return len(self.shards)
@@ -49,6 +49,35 @@ class Game(ABC):
         """
         pass
 
+    def apply(self, board, action):
+        """
+        Optional, in-place version of getNextState for canonical boards, used
+        by MCTS to walk down the tree without copying boards. Games that do
+        not implement it keep using getNextState.
+
+        Input:
+            board: current board in its canonical form, which is changed in
+                   place into the canonical form of the board after action,
+                   i.e. getCanonicalForm(*getNextState(board, 1, action))
+            action: action taken by the current player
+
+        Returns:
+            token: anything undo needs to restore board
+        """
+        raise NotImplementedError
+
+    def undo(self, board, token):
+        """
+        Reverts the apply call that returned token. Several apply calls are
+        undone in reverse order.
+
+        Input:
+            board: the board given to apply, changed in place back into the
+                   board before that call
+            token: the value returned by that apply call
+        """
+        raise NotImplementedError
+
     def getValidMoves(self, board, player):
         """
         Input:
@@ -114,3 +143,25 @@ class Game(ABC):
                          Required by MCTS for hashing.
         """
         pass
+
+    def hashKey(self, board):
+        """
+        Input:
+            board: current board
+
+        Returns:
+            key: a hashable key identifying board, used by MCTS to look boards
+                 up. Games should override this to return a 64-bit integer,
+                 e.g. a Zobrist hash kept up to date in getNextState, which
+                 is cheaper to compute, compare and store than the string
+                 representation returned by default.
+        """
+        return self.stringRepresentation(board)
+
+    def getDrawValue(self):
+        """
+        Returns:
+            r: the value getGameEnded returns for a draw. MCTS scores a board
+               that repeats along a descent with it.
+        """
+        return 1e-4
@@ -1,15 +1,143 @@
 import logging
 import math
+import sys
+import time
+from collections import OrderedDict
 
 import numpy as np
 
+from EvalCache import sharedCache
+from Game import Game
 from utils import encode_board
 
 EPS = 1e-8
+TABLE_ENTRY_BYTES = 80  # memory of an entry of the node table (an OrderedDict), as measured on CPython
 
 log = logging.getLogger(__name__)
 
 
+def countsToProbs(counts, temp):
+    """
+    Returns:
+        probs: a policy vector where the probability of the ith action is
+               proportional to counts[i]**(1./temp). For temp=0 all
+               probability goes to one of the most visited actions, chosen
+               at random.
+    """
+    if temp == 0:
+        bestAs = np.array(np.argwhere(counts == np.max(counts))).flatten()
+        bestA = np.random.choice(bestAs)
+        probs = [0] * len(counts)
+        probs[bestA] = 1
+        return probs
+
+    counts = [x ** (1. / temp) for x in counts]
+    counts_sum = float(sum(counts))
+    probs = [x / counts_sum for x in counts]
+    return probs
+
+
+class SearchBudget():
+    """
+    Tracks the simulations of one getActionProb call against numSims, the
+    time budget in milliseconds (None for no budget) and the early stop rule.
+    """
+
+    def __init__(self, numSims, timeBudgetMs, earlyStop):
+        self.numSims = numSims
+        self.sims = 0  # simulations performed so far
+        self.start = time.time()
+        self.deadline = self.start + timeBudgetMs / 1000. if timeBudgetMs is not None else None
+        self.earlyStop = earlyStop
+
+    def isDone(self, mcts, s):
+        """
+        Returns True if the search from board s of mcts should stop.
+        """
+        if self.sims >= self.numSims or mcts._isSolved(s):
+            return True
+        remaining = self.numSims - self.sims
+        if self.deadline is not None:
+            now = time.time()
+            if now >= self.deadline:
+                return True
+            if self.sims > 0:
+                # estimated from the pace of this call, which has no simulation to measure before the first one
+                remaining = min(remaining, self.sims * (self.deadline - now) / max(now - self.start, EPS))
+        return self.earlyStop and mcts._isDecided(s, remaining)
+
+
+class SearchMetrics():
+    """
+    Counters and timings (in seconds) of MCTS searches: either of a single
+    getActionProb call (MCTS.metrics) or summed over all calls so far
+    (MCTS.totalMetrics).
+    """
+
+    def __init__(self):
+        self.searches = 0  # getActionProb calls
+        self.sims = 0  # simulations performed
+        self.nodesExpanded = 0
+        self.networkCalls = 0  # calls to nnet.predict / nnet.predict_batch
+        self.networkBoards = 0  # boards evaluated by the network
+        self.transpositionHits = 0  # edges taken for the first time into an already expanded board
+        self.maxDepth = 0  # longest path walked down from the root
+        self.gameTime = 0.  # game logic: moves, terminal checks, valid moves and hashing
+        self.networkTime = 0.  # encoding boards and evaluating them with the network
+        self.selectTime = 0.  # choosing the action to follow at each node
+        self.totalTime = 0.  # wall time of the getActionProb calls
+
+    def add(self, other):
+        """
+        Adds the counts and times of other to these metrics.
+        """
+        for key, value in vars(other).items():
+            if key == 'maxDepth':
+                self.maxDepth = max(self.maxDepth, value)
+            else:
+                setattr(self, key, getattr(self, key) + value)
+
+    def __str__(self):
+        return ('%d searches, %d sims, %d expanded, %d network calls (%d boards), %d transpositions, '
+                'max depth %d, time %.2fs (game %.2fs, network %.2fs, select %.2fs)'
+                % (self.searches, self.sims, self.nodesExpanded, self.networkCalls, self.networkBoards,
+                   self.transpositionHits, self.maxDepth, self.totalTime, self.gameTime,
+                   self.networkTime, self.selectTime))
+
+
+class Node():
+    """
+    A row of the node table: statistics for the edges (s,a) leaving one
+    expanded state s. Only the valid actions are stored, the arrays are
+    indexed by the position i of a in actions.
+    """
+    __slots__ = ('actions', 'P', 'N', 'Q', 'n', 'VL', 'vl', 'children', 'stamp', 'S', 'proven', 'counted')
+
+    def __init__(self, actions, P):
+        self.actions = actions  # the valid actions a, as returned by game.getValidMoves
+        self.P = P  # initial policy (returned by neural net), restricted to actions and renormalized
+        self.N = np.zeros(len(P), dtype=np.int64)  # #times edge s,a was visited
+        self.Q = np.zeros(len(P), dtype=np.float64)  # Q values for s,a (as defined in the paper)
+        self.n = 0  # #times board s was visited
+        self.VL = None  # pending (virtual loss) visits of edge s,a, allocated on first use
+        self.vl = 0  # pending (virtual loss) visits of board s
+        self.children = {}  # key of the canonical board reached by each visited i
+        self.stamp = 0  # the MCTS.stamp of the last search that visited board s
+        self.S = None  # proven values of s,a (nan if unknown) with args.useSolver, allocated on first use
+        self.proven = None  # proven value of board s for its current player, if solved
+        self.counted = 0  # the nbytes() of this node counted in MCTS.residentBytes, None once evicted
+
+    def nbytes(self):
+        """
+        Returns the memory held by this node in bytes: the node itself, its
+        arrays with their headers and its children dict with the keys in it.
+        """
+        arrays = [a for a in (self.actions, self.P, self.N, self.Q, self.VL, self.S) if a is not None]
+        # getsizeof counts the data of the arrays that own it only
+        return sys.getsizeof(self) + sum(sys.getsizeof(a) + (0 if a.flags.owndata else a.nbytes) for a in arrays) + \
+            sys.getsizeof(self.children) + sum(sys.getsizeof(t) for t in self.children.values())
+
+
 class MCTS():
     """
     This class handles the MCTS tree.
@@ -19,52 +147,216 @@ class MCTS():
         self.game = game
         self.nnet = nnet
         self.args = args
-        self.Qsa = {}  # stores Q values for s,a (as defined in the paper)
-        self.Nsa = {}  # stores #times edge s,a was visited
-        self.Ns = {}  # stores #times board s was visited
-        self.Ps = {}  # stores initial policy (returned by neural net)
+        # key of a board in the tables below, an integer hash if the game provides one
+        self.hashKey = getattr(game, 'hashKey', game.stringRepresentation)
+        # value of a board that repeats along a descent, which is scored like a draw
+        self.drawValue = game.getDrawValue() if hasattr(game, 'getDrawValue') else 1e-4
+        # whether the game can make and unmake moves in place, see _descend
+        self.applyInPlace = isinstance(game, Game) and type(game).apply is not Game.apply
+        self.nodes = OrderedDict()  # node table: stores a Node for every expanded board s, least recently visited first
 
         self.Es = {}  # stores game.getGameEnded ended for board s
-        self.Vs = {}  # stores game.getValidMoves for board s
 
-    def getActionProb(self, canonicalBoard, temp=1):
+        self.stamp = 0  # counts calls to search/searchBatch, nodes visited by the current one are never evicted
+        self.residentBytes = 0  # approximate memory held by the node table and Es, overheads included
+        self.evictions = 0  # number of nodes evicted to stay within args.maxTreeNodes / args.maxTreeBytes
+
+        self.metrics = SearchMetrics()  # of the last getActionProb call
+        self.totalMetrics = SearchMetrics()  # of all getActionProb calls
+        self.trace = None  # optional callback trace(board, depth), called with every canonical board reached by a descent
+        # network evaluations shared by all MCTS of the process, if args.evalCacheSize is set
+        self.cache = sharedCache(args.evalCacheSize) if args.get('evalCacheSize') else None
+
+    def getActionProb(self, canonicalBoard, temp=1, timeBudgetMs=None, numSims=None):
         """
         This function performs numMCTSSims simulations of MCTS starting from
-        canonicalBoard.
+        canonicalBoard, or numSims simulations if given.
+
+        If a time budget is given (timeBudgetMs, else args.timeBudgetMs), the
+        search also stops once that many milliseconds have passed, whichever
+        comes first. If args.earlyStop is set and temp=0, the search stops as
+        soon as the most visited action cannot be overtaken any more within
+        the remaining simulations (or, with a time budget, within the number
+        of simulations expected to fit in the remaining time).
+
+        If args.leafBatchSize is larger than 1, up to that many leaves are
+        collected per round (spread out by virtual loss) and evaluated with a
+        single nnet.predict_batch call, see searchBatch.
+
+        If args.reuseTree is set, canonicalBoard first becomes the root of the
+        tree (see advanceRoot) and the visits already made below it count
+        towards numMCTSSims.
+
+        If args.useSolver is set, proven wins, losses and draws are propagated
+        up the tree (see _propagateProof). Solved subtrees are not searched
+        any more, and the search returns as soon as canonicalBoard is solved.
+        If it is not a proven loss, the probability is then spread over the
+        actions that reach its proven value.
+
+        If args.evalCacheSize is set, network evaluations are looked up in
+        and added to the evaluation cache shared by all MCTS of the process
+        (see EvalCache), which holds up to that many evaluations.
+
+        The counters and timings of the call are kept in self.metrics, and
+        added to self.totalMetrics.
 
         Returns:
             probs: a policy vector where the probability of the ith action is
-                   proportional to Nsa[(s,a)]**(1./temp)
+                   proportional to N(s,a)**(1./temp)
+        """
+        budget = self._startBudget(canonicalBoard, temp, timeBudgetMs, numSims)
+        s = self.hashKey(canonicalBoard)
+        if self.args.get('dirichletAlpha'):
+            if s not in self.nodes and budget.numSims > 0:
+                # expand the root first
+                self.search(canonicalBoard)
+                budget.sims += 1
+            self._addRootNoise(s)
+
+        while not budget.isDone(self, s):
+            budget.sims += self._simulate(canonicalBoard, budget.numSims - budget.sims)
+
+        self._finishBudget(budget)
+        return self._getProbs(canonicalBoard, temp)
+
+    def _getProbs(self, canonicalBoard, temp):
+        """
+        Returns:
+            probs: the policy vector for canonicalBoard after searching, see
+                   getActionProb
+        """
+        node = self.nodes.get(self.hashKey(canonicalBoard))
+        if node is not None and node.proven is not None and node.proven > -1:
+            # solved: play one of the actions reaching the proven value
+            best = np.zeros(self.game.getActionSize(), dtype=int)
+            best[node.actions[node.S == node.proven]] = 1
+            return countsToProbs(best.tolist(), temp)
+        return countsToProbs(self.getCounts(canonicalBoard), temp)
+
+    def _isSolved(self, s):
+        node = self.nodes.get(s)
+        return node is not None and node.proven is not None
+
+    def _startBudget(self, canonicalBoard, temp, timeBudgetMs, numSims=None):
+        """
+        Advances the root if args.reuseTree is set, resets self.metrics and
+        returns the SearchBudget of a getActionProb call.
         """
-        for i in range(self.args.numMCTSSims):
-            self.search(canonicalBoard)
+        self.metrics = SearchMetrics()
+        if numSims is None:
+            numSims = self.args.numMCTSSims
+        if self.args.get('reuseTree', False):
+            numSims -= self.advanceRoot(canonicalBoard)
+        if timeBudgetMs is None:
+            timeBudgetMs = self.args.get('timeBudgetMs')
+        return SearchBudget(numSims, timeBudgetMs, temp == 0 and self.args.get('earlyStop', False))
+
+    def _finishBudget(self, budget):
+        """
+        Completes self.metrics of the getActionProb call of budget and adds
+        them to self.totalMetrics.
+        """
+        self.metrics.searches = 1
+        self.metrics.sims = budget.sims
+        self.metrics.totalTime = time.time() - budget.start
+        self.totalMetrics.add(self.metrics)
 
-        s = self.game.stringRepresentation(canonicalBoard)
-        counts = [self.Nsa[(s, a)] if (s, a) in self.Nsa else 0 for a in range(self.game.getActionSize())]
+    def _simulate(self, canonicalBoard, maxSims):
+        """
+        Runs one round of at most maxSims simulations from canonicalBoard: a
+        single search, or one searchBatch if args.leafBatchSize is larger
+        than 1. The time budget and early stop are checked between rounds.
 
-        if temp == 0:
-            bestAs = np.array(np.argwhere(counts == np.max(counts))).flatten()
-            bestA = np.random.choice(bestAs)
-            probs = [0] * len(counts)
-            probs[bestA] = 1
-            return probs
+        Returns:
+            sims: the number of simulations performed
+        """
+        batchSize = self.args.get('leafBatchSize', 1)
+        if batchSize > 1:
+            return self.searchBatch(canonicalBoard, min(batchSize, maxSims))
+        self.search(canonicalBoard)
+        return 1
 
-        counts = [x ** (1. / temp) for x in counts]
-        counts_sum = float(sum(counts))
-        probs = [x / counts_sum for x in counts]
-        return probs
+    def getCounts(self, canonicalBoard):
+        """
+        Returns:
+            counts: a list with the visit count N(s,a) of every action from
+                    canonicalBoard
+        """
+        counts = np.zeros(self.game.getActionSize(), dtype=np.int64)
+        node = self.nodes.get(self.hashKey(canonicalBoard))
+        if node is not None:
+            counts[node.actions] = node.N
+        return counts.tolist()
+
+    def _addRootNoise(self, s):
+        """
+        Mixes Dirichlet noise with parameter args.dirichletAlpha into the
+        prior of the valid actions of board s, with weight
+        args.dirichletEpsilon (default 0.25).
+        """
+        node = self.nodes.get(s)
+        if node is None:
+            return
+        eps = self.args.get('dirichletEpsilon', 0.25)
+        noise = np.random.dirichlet([self.args.dirichletAlpha] * len(node.P))
+        node.P = (1 - eps) * node.P + eps * noise
+
+    def _isDecided(self, s, remaining):
+        """
+        Returns True if no other valid action of board s can reach the visit
+        count of the most visited one within remaining further simulations.
+        """
+        node = self.nodes.get(s)
+        if node is None or node.N.sum() == 0:
+            # not searched yet, there are no visits to play from
+            return False
+        if len(node.N) < 2:
+            # a forced move
+            return True
+        second, best = np.partition(node.N, -2)[-2:]
+        return best - second > remaining
+
+    def advanceRoot(self, canonicalBoard):
+        """
+        Makes canonicalBoard the root of the search tree. The subtree below it
+        is kept together with its statistics, every node that can no longer
+        be reached from it is freed.
+
+        Returns:
+            n: the number of visits of canonicalBoard kept from earlier searches
+        """
+        s = self.hashKey(canonicalBoard)
+        reachable = set()
+        stack = [s]
+        while stack:
+            t = stack.pop()
+            if t in reachable:
+                continue
+            reachable.add(t)
+            node = self.nodes.get(t)
+            if node is not None:
+                stack.extend(node.children.values())
+
+        self.nodes = OrderedDict((t, node) for t, node in self.nodes.items() if t in reachable)
+        self.Es = {t: e for t, e in self.Es.items() if t in reachable}
+        self.residentBytes = sum(self._nodeBytes(t, node) for t, node in self.nodes.items()) + \
+            sum(self._endedBytes(t, e) for t, e in self.Es.items())
+
+        root = self.nodes.get(s)
+        return root.n if root is not None else 0
 
     def search(self, canonicalBoard):
         """
-        This function performs one iteration of MCTS. It is recursively called
-        till a leaf node is found. The action chosen at each node is one that
-        has the maximum upper confidence bound as in the paper.
+        This function performs one iteration of MCTS. It walks down the tree
+        from canonicalBoard till a leaf node is found, keeping the edges taken
+        in an explicit path. The action chosen at each node is one that has
+        the maximum upper confidence bound as in the paper.
 
         Once a leaf node is found, the neural network is called to return an
         initial policy P and a value v for the state. This value is propagated
-        up the search path. In case the leaf node is a terminal state, the
-        outcome is propagated up the search path. The values of Ns, Nsa, Qsa are
-        updated.
+        up the search path in a loop. In case the leaf node is a terminal
+        state, the outcome is propagated up the search path. The visit counts
+        and Q values in the node table are updated.
 
         NOTE: the return values are the negative of the value of the current
         state. This is done since v is in [-1,1] and if v is the value of a
@@ -73,71 +365,343 @@ class MCTS():
         Returns:
             v: the negative of the value of the current canonicalBoard
         """
+        self.stamp += 1
+        path, s, board, v = self._descend(canonicalBoard, 0)
+        if v is None:
+            v = self._expandCached(s)
+        if v is None:
+            # leaf node
+            # first encode and then feed
+            clock = time.perf_counter()
+            encoded = encode_board(board)
+            pi, v = self.nnet.predict(encoded)
+            self._countNetwork(1, time.perf_counter() - clock)
+            v = self._expand(s, board, pi, v)
+        v = self._backup(path, v)
+        self._evict()
+        return -v
 
-        s = self.game.stringRepresentation(canonicalBoard)
+    def searchBatch(self, canonicalBoard, batchSize):
+        """
+        This function performs up to batchSize simulations of MCTS starting
+        from canonicalBoard, evaluating all of their leaves together.
 
-        if s not in self.Es:
-            self.Es[s] = self.game.getGameEnded(canonicalBoard, 1)
-        if self.Es[s] != 0:
-            # terminal node
-            return -self.Es[s]
+        Every descent adds a virtual loss of args.virtualLoss (default 1) to
+        the edges it takes, so that the following descents of the same round
+        are pushed towards other paths. The collected leaves are evaluated
+        with one call to nnet.predict_batch, after which the values are backed
+        up and the virtual losses removed. Terminal leaves are backed up right
+        away. A descent that reaches a leaf which is already waiting for
+        evaluation ends the round early and is not counted.
 
-        if s not in self.Ps:
-            # leaf node
-            # first encode and then feed
-            encoded = encode_board(canonicalBoard)
-            self.Ps[s], v = self.nnet.predict(encoded)
-            valids = self.game.getValidMoves(canonicalBoard, 1)
-            self.Ps[s] = self.Ps[s] * valids  # masking invalid moves
-            sum_Ps_s = np.sum(self.Ps[s])
-            if sum_Ps_s > 0:
-                self.Ps[s] /= sum_Ps_s  # renormalize
+        Returns:
+            sims: the number of simulations performed
+        """
+        self.stamp += 1
+        virtualLoss = self.args.get('virtualLoss', 1)
+        pending = {}  # leaf s -> (encoded board, canonical board, path)
+        sims = 0
+
+        while sims < batchSize:
+            path, s, board, v = self._descend(canonicalBoard, virtualLoss)
+            if v is None and s not in pending:
+                v = self._expandCached(s)
+            if v is not None:
+                # terminal node, or evaluated before
+                self._backup(path, v, virtualLoss)
+            elif s in pending:
+                # collision with a leaf of this round
+                self._revertVirtualLoss(path, virtualLoss)
+                break
             else:
-                # if all valid moves were masked make all valid moves equally probable
-
-                # NB! All valid moves may be masked if either your NNet architecture is insufficient or you've get overfitting or something else.
-                # If you have got dozens or hundreds of these messages you should pay attention to your NNet and/or training process.   
-                log.error("All valid moves were masked, doing a workaround.")
-                self.Ps[s] = self.Ps[s] + valids
-                self.Ps[s] /= np.sum(self.Ps[s])
-
-            self.Vs[s] = valids
-            self.Ns[s] = 0
-            return -v
-
-        valids = self.Vs[s]
-        cur_best = -float('inf')
-        best_act = -1
-
-        # pick the action with the highest upper confidence bound
-        for a in range(self.game.getActionSize()):
-            if valids[a]:
-                if (s, a) in self.Qsa:
-                    u = self.Qsa[(s, a)] + self.args.cpuct * self.Ps[s][a] * math.sqrt(self.Ns[s]) / (
-                            1 + self.Nsa[(s, a)])
+                clock = time.perf_counter()
+                pending[s] = (encode_board(board), board, path)
+                self.metrics.networkTime += time.perf_counter() - clock
+            sims += 1
+
+        if pending:
+            encoded, boards, paths = zip(*pending.values())
+            clock = time.perf_counter()
+            pis, vs = self.nnet.predict_batch(np.array(encoded))
+            self._countNetwork(len(encoded), time.perf_counter() - clock)
+            for s, board, path, pi, v in zip(pending, boards, paths, pis, vs):
+                self._backup(path, self._expand(s, board, pi, v), virtualLoss)
+        self._evict()
+
+        return sims
+
+    def _descend(self, canonicalBoard, virtualLoss):
+        """
+        Walks down the tree from canonicalBoard, following the action with the
+        highest upper confidence bound, until a leaf or terminal node is
+        reached. Adds virtualLoss pending visits to every edge on the way. A
+        board that is reached a second time ends the walk like a drawn
+        terminal board (see Game.getDrawValue), as the tree has a cycle there.
+
+        If the game implements apply and undo, edges into boards that are
+        already expanded or terminal are followed by changing canonicalBoard
+        in place, and these moves are undone before returning. Only the step
+        into a new leaf copies the board, with getNextState.
+
+        Returns:
+            path: a list of (node, i) for the edges taken, where i is the
+                  position of the action in node.actions
+            s: the key of the last board, see hashKey
+            board: the last board in canonical form, if it is a leaf
+            v: the value of the last board for its current player if it is
+               terminal or repeated, else None
+        """
+        metrics = self.metrics
+        path = []
+        onPath = set()  # keys of the boards on path
+        applied = []  # undo tokens of the moves applied to canonicalBoard in place
+        board = canonicalBoard
+        clock = time.perf_counter()
+        try:
+            while True:
+                s = self.hashKey(board)
+                if path and i not in node.children:
+                    if s in self.nodes:
+                        metrics.transpositionHits += 1
+                    node.children[i] = s
+                    self._recount(node)
+
+                if s in onPath:
+                    # the board repeats, the cycle is scored as a draw
+                    v = self.drawValue
+                    break
+                onPath.add(s)
+
+                if s not in self.Es:
+                    self.Es[s] = self.game.getGameEnded(board, 1)
+                    self.residentBytes += self._endedBytes(s, self.Es[s])
+                if self.Es[s] != 0:
+                    # terminal node
+                    v = self.Es[s]
+                    break
+
+                node = self.nodes.get(s)
+                if node is None:
+                    # leaf node
+                    v = None
+                    break
+                self.nodes.move_to_end(s)
+                node.stamp = self.stamp
+                if node.proven is not None:
+                    # solved node, treated like a terminal one
+                    v = node.proven
+                    break
+
+                now = time.perf_counter()
+                metrics.gameTime += now - clock
+                i = self._selectAction(node)
+                clock = time.perf_counter()
+                metrics.selectTime += clock - now
+                if virtualLoss:
+                    if node.VL is None:
+                        node.VL = np.zeros(len(node.N), dtype=np.int64)
+                        self._recount(node)
+                    node.VL[i] += virtualLoss
+                    node.vl += virtualLoss
+                path.append((node, i))
+
+                action = node.actions[i]
+                child = node.children.get(i)
+                if self.applyInPlace and board is not canonicalBoard:
+                    # a copy made by this descent, which is free to change
+                    self.game.apply(board, action)
+                elif self.applyInPlace and (child in self.nodes or self.Es.get(child, 0) != 0):
+                    # the next board is not a leaf, it need not be kept
+                    applied.append(self.game.apply(board, action))
                 else:
-                    u = self.args.cpuct * self.Ps[s][a] * math.sqrt(self.Ns[s] + EPS)  # Q = 0 ?
+                    board, next_player = self.game.getNextState(board, 1, action)
+                    board = self.game.getCanonicalForm(board, next_player)
+                if self.trace is not None:
+                    self.trace(board, len(path))
+        finally:
+            for token in reversed(applied):
+                self.game.undo(canonicalBoard, token)
+
+        metrics.gameTime += time.perf_counter() - clock
+        metrics.maxDepth = max(metrics.maxDepth, len(path))
+        return path, s, board, v
+
+    def _backup(self, path, v, virtualLoss=0):
+        """
+        Propagates the value v of the last board of path (for its current
+        player) up the path, removing virtualLoss pending visits on the way.
+
+        Returns:
+            v: the value of the first board of path for its current player
+        """
+        for node, i in reversed(path):
+            v = -v
+            node.Q[i] = (node.N[i] * node.Q[i] + v) / (node.N[i] + 1)
+            node.N[i] += 1
+            node.n += 1
+        self._revertVirtualLoss(path, virtualLoss)
+        if self.args.get('useSolver', False):
+            self._propagateProof(path)
+        return v
+
+    def _propagateProof(self, path):
+        """
+        Propagates a proven value of the last board of path up the path, as
+        far as it proves the boards on it. A board is proven won if one of
+        its actions leads to a proven loss for the opponent, otherwise it is
+        proven once all its valid actions are, with the best of their values.
+        """
+        for node, i in reversed(path):
+            t = node.children[i]
+            child = self.nodes.get(t)
+            if self.Es.get(t, 0) != 0:
+                childProven = self.Es[t]
+            elif child is not None and child.proven is not None:
+                childProven = child.proven
+            else:
+                return
+
+            if node.S is None:
+                node.S = np.full(len(node.N), np.nan)
+                self._recount(node)
+            node.S[i] = -childProven
+            if np.any(node.S == 1):
+                node.proven = 1
+            elif not np.isnan(node.S).any():
+                node.proven = float(np.max(node.S))
+            else:
+                return
 
-                if u > cur_best:
-                    cur_best = u
-                    best_act = a
+    def _revertVirtualLoss(self, path, virtualLoss):
+        if virtualLoss:
+            for node, i in path:
+                node.VL[i] -= virtualLoss
+                node.vl -= virtualLoss
 
-        a = best_act
-        next_s, next_player = self.game.getNextState(canonicalBoard, 1, a)
-        print(next_s, end="\n---\n")
-        next_s = self.game.getCanonicalForm(next_s, next_player)
+    def _expand(self, s, canonicalBoard, pi, v):
+        """
+        Adds the leaf canonicalBoard to the node table, using the network
+        output pi, v.
+
+        Returns:
+            v: the value of canonicalBoard for its current player, as a float
+        """
+        clock = time.perf_counter()
+        actions = np.flatnonzero(self.game.getValidMoves(canonicalBoard, 1))
+        self.metrics.gameTime += time.perf_counter() - clock
+        P = self._maskPolicy(pi, actions)
+        v = np.asarray(v).item()
+        if self.cache is not None:
+            self.cache.put((s, self.nnet.modelVersion()), (actions, P, v))
+        self._addNode(s, actions, P)
+        return v
+
+    def _expandCached(self, s):
+        """
+        Adds the leaf s to the node table from the evaluation cache, if it
+        holds an evaluation of s by the current network.
 
+        Returns:
+            v: the value of s for its current player, or None if s was not
+               cached
+        """
+        if self.cache is None:
+            return None
+        entry = self.cache.get((s, self.nnet.modelVersion()))
+        if entry is None:
+            return None
+        actions, P, v = entry
+        self._addNode(s, actions, P)
+        return v
+
+    def _addNode(self, s, actions, P):
+        node = Node(actions, P)
+        node.stamp = self.stamp
+        self.nodes[s] = node
+        node.counted = node.nbytes()
+        self.residentBytes += self._nodeBytes(s, node)
+        self.metrics.nodesExpanded += 1
+
+    def _countNetwork(self, numBoards, seconds):
+        """
+        Records a network call that evaluated numBoards boards in seconds.
+        """
+        self.metrics.networkCalls += 1
+        self.metrics.networkBoards += numBoards
+        self.metrics.networkTime += seconds
 
+    def _nodeBytes(self, s, node):
+        return node.counted + sys.getsizeof(s) + TABLE_ENTRY_BYTES
 
-        v = self.search(next_s)
+    def _recount(self, node):
+        # the node grew after it was added, by a child or an array allocated on first use
+        if node.counted is None:
+            return
+        size = node.nbytes()
+        self.residentBytes += size - node.counted
+        node.counted = size
 
-        if (s, a) in self.Qsa:
-            self.Qsa[(s, a)] = (self.Nsa[(s, a)] * self.Qsa[(s, a)] + v) / (self.Nsa[(s, a)] + 1)
-            self.Nsa[(s, a)] += 1
+    def _endedBytes(self, s, e):
+        return sys.getsizeof(s) + sys.getsizeof(e)
 
+    def _evict(self):
+        """
+        Evicts the least recently visited nodes while the node table is larger
+        than args.maxTreeNodes nodes or args.maxTreeBytes bytes. Nodes visited
+        by the current search, which include the root and the paths taken,
+        are never evicted. The Es entries of an evicted node and of its
+        children without a node (terminal boards) go with it.
+        """
+        maxNodes = self.args.get('maxTreeNodes') or float('inf')
+        maxBytes = self.args.get('maxTreeBytes') or float('inf')
+        while len(self.nodes) > maxNodes or self.residentBytes > maxBytes:
+            s, node = next(iter(self.nodes.items()))
+            if node.stamp == self.stamp:
+                # all remaining nodes were visited by the current search
+                break
+            del self.nodes[s]
+            self.residentBytes -= self._nodeBytes(s, node)
+            node.counted = None
+            for t in [s, *node.children.values()]:
+                if t in self.Es and t not in self.nodes:
+                    self.residentBytes -= self._endedBytes(t, self.Es.pop(t))
+            self.evictions += 1
+
+    def _maskPolicy(self, pi, actions):
+        """
+        Restricts the network policy pi to the valid actions and renormalizes
+        it.
+        """
+        P = np.asarray(pi)[actions].astype(np.float64)  # masking invalid moves
+        sum_P = np.sum(P)
+        if sum_P > 0:
+            P /= sum_P  # renormalize
         else:
-            self.Qsa[(s, a)] = v
-            self.Nsa[(s, a)] = 1
+            # if all valid moves were masked make all valid moves equally probable
 
-        self.Ns[s] += 1
-        return -v
+            # NB! All valid moves may be masked if either your NNet architecture is insufficient or you've get overfitting or something else.
+            # If you have got dozens or hundreds of these messages you should pay attention to your NNet and/or training process.
+            log.error("All valid moves were masked, doing a workaround.")
+            P = np.full(len(actions), 1. / len(actions))
+        return P
+
+    def _selectAction(self, node):
+        """
+        Returns the position i in node.actions of the action with the highest
+        upper confidence bound, computed for all edges of node at once.
+        Pending visits count as visits with value -1. Actions with a proven
+        value are skipped.
+        """
+        cpuct = self.args.cpuct
+        if node.vl:
+            N = node.N + node.VL
+            Q = (node.N * node.Q - node.VL) / np.maximum(N, 1)
+            n = node.n + node.vl
+        else:
+            N, Q, n = node.N, node.Q, node.n
+        u = np.where(N > 0,
+                     Q + cpuct * node.P * math.sqrt(n) / (1 + N),
+                     cpuct * node.P * math.sqrt(n + EPS))  # Q = 0 ?
+        if node.S is not None:
+            u[~np.isnan(node.S)] = -np.inf
+        return int(np.argmax(u))
@@ -1,3 +1,23 @@
+import functools
+import itertools
+
+_modelVersions = itertools.count(1)  # model version tokens, unique within the process
+
+
+def _changesWeights(method):
+    """
+    Wraps a method that changes the weights of the network so that it gives
+    the network a new model version.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._modelVersion = next(_modelVersions)
+    return wrapper
+
+
 class NeuralNet():
     """
     This class specifies the base NeuralNet class. To define your own neural
@@ -6,11 +26,31 @@ class NeuralNet():
     the canonical form of the board.
 
     See othello/NNet.py for an example implementation.
+
+    The train, load_checkpoint and set_weights methods of subclasses are
+    wrapped so that they give the network a new modelVersion.
     """
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name in ('train', 'load_checkpoint', 'set_weights'):
+            if name in cls.__dict__:
+                setattr(cls, name, _changesWeights(cls.__dict__[name]))
+
     def __init__(self, game):
         pass
 
+    def modelVersion(self):
+        """
+        Returns:
+            version: a token identifying this network with its current
+                     weights, which changes whenever they are trained or
+                     loaded. Tokens are never reused within a process.
+        """
+        if '_modelVersion' not in self.__dict__:
+            self._modelVersion = next(_modelVersions)
+        return self._modelVersion
+
     def train(self, examples):
         """
         This function trains the neural network with examples obtained from
@@ -20,7 +60,10 @@ class NeuralNet():
             examples: a list of training examples, where each example is of form
                       (board, pi, v). pi is the MCTS informed policy vector for
                       the given board, and v is its value. The examples has
-                      board in its canonical form.
+                      board in its canonical form. Coach passes a
+                      ReplayBuffer, which can be used like such a list;
+                      stackExamples and sampleExamples of ReplayBuffer read
+                      either as stacked arrays.
         """
         pass
 
@@ -36,6 +79,22 @@ class NeuralNet():
         """
         pass
 
+    def predict_batch(self, boards):
+        """
+        Input:
+            boards: an array of boards in their canonical form, stacked along
+                    the first axis.
+
+        Returns:
+            pis: a policy vector for every board
+            vs: a value in [-1,1] for every board
+
+        The default implementation calls predict once per board. Override it
+        to run the network on the whole batch at once.
+        """
+        pis, vs = zip(*[self.predict(board) for board in boards])
+        return list(pis), list(vs)
+
     def save_checkpoint(self, folder, filename):
         """
         Saves the current neural network (with its parameters) in
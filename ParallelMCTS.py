@@ -0,0 +1,230 @@
+import logging
+import math
+import multiprocessing as mp
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from MCTS import MCTS, SearchMetrics, countsToProbs
+from utils import dotdict, encode_board
+
+log = logging.getLogger(__name__)
+
+# the MCTS of a RootParallelMCTS worker process
+_worker = None
+
+
+def _initRootWorker(game, nnetClass, folder, filename, args, seed):
+    global _worker
+    nnet = nnetClass(game)
+    nnet.load_checkpoint(folder=folder, filename=filename)
+    np.random.seed(seed % (2 ** 32))
+    _worker = MCTS(game, nnet, dotdict(args))
+
+
+def _rootSearch(canonicalBoard, temp):
+    """
+    Searches from canonicalBoard in the worker's own tree.
+
+    Returns:
+        counts: the visits of every action from canonicalBoard in the
+                worker's tree, including those kept from earlier searches
+        proven: the proven value of canonicalBoard for its current player
+                with args.useSolver, None if it is not solved
+        best: 1 for the actions reaching proven and 0 for the others, None
+              if canonicalBoard is not solved
+        metrics: the SearchMetrics of the worker's search
+    """
+    _worker.getActionProb(canonicalBoard, temp=temp)
+    node = _worker.nodes.get(_worker.hashKey(canonicalBoard))
+    proven, best = None, None
+    if node is not None and node.proven is not None:
+        proven = node.proven
+        best = np.zeros(_worker.game.getActionSize(), dtype=int)
+        best[node.actions[node.S == proven]] = 1
+    return np.array(_worker.getCounts(canonicalBoard)), proven, best, _worker.metrics
+
+
+class RootParallelMCTS():
+    """
+    Root-parallel MCTS. args.numMCTSWorkers processes (default: one per core)
+    each keep their own MCTS with their own tree. For every move they search
+    independently from the same root, sharing the numMCTSSims simulations, and
+    their root visit counts are summed before computing the action
+    probabilities. With args.useSolver, a root solved by any worker is played
+    like MCTS plays a solved root instead, from the best proven value found
+    by the workers. Every worker is a pool of its own, so that each of them
+    runs exactly one search per move.
+
+    Every worker loads a copy of nnet, which is saved for that purpose to
+    args.checkpoint (default './temp/') as 'root_parallel_<id>.pth.tar' and
+    deleted by close(). Unless
+    args.dirichletAlpha is given, the workers add Dirichlet noise with alpha
+    0.3 to the root prior so that their searches do not all follow the same
+    path.
+
+    The workers are started with the 'spawn' method, so the script creating
+    a RootParallelMCTS must guard its top level with
+    if __name__ == "__main__" (as main.py does). Call close() to stop the
+    worker processes.
+
+    self.metrics and self.totalMetrics sum the SearchMetrics of the workers,
+    so their times add up the time spent in every worker.
+    """
+
+    def __init__(self, game, nnet, args):
+        self.game = game
+        self.args = args
+        self.numWorkers = args.get('numMCTSWorkers') or os.cpu_count()
+        self.metrics = SearchMetrics()  # of the last getActionProb call
+        self.totalMetrics = SearchMetrics()  # of all getActionProb calls
+
+        folder = args.get('checkpoint', './temp/')
+        filename = 'root_parallel_%d.pth.tar' % id(self)
+        nnet.save_checkpoint(folder=folder, filename=filename)
+        self.checkpointFile = os.path.join(folder, filename)
+
+        workerArgs = dict(args)
+        workerArgs['numMCTSSims'] = math.ceil(args.numMCTSSims / self.numWorkers)
+        workerArgs.setdefault('dirichletAlpha', 0.3)
+        context = mp.get_context('spawn')
+        seed = np.random.randint(2 ** 31)
+        # one single-process pool per worker, as a shared pool may hand several tasks to the same worker
+        self.pools = [context.Pool(1, initializer=_initRootWorker,
+                                   initargs=(game, nnet.__class__, folder, filename, workerArgs, seed + i))
+                      for i in range(self.numWorkers)]
+
+    def getActionProb(self, canonicalBoard, temp=1):
+        """
+        This function performs numMCTSSims simulations of MCTS starting from
+        canonicalBoard, spread over the worker processes.
+
+        Returns:
+            probs: a policy vector where the probability of the ith action is
+                   proportional to the summed visit counts**(1./temp)
+        """
+        results = [pool.apply_async(_rootSearch, (canonicalBoard, temp)) for pool in self.pools]
+        counts, proven, best, metrics = zip(*[result.get() for result in results])
+        self.metrics = SearchMetrics()
+        for m in metrics:
+            self.metrics.add(m)
+        self.totalMetrics.add(self.metrics)
+        solved = [(p, b) for p, b in zip(proven, best) if p is not None and p > -1]
+        if solved:
+            # a proof holds whichever worker found it, play one of the actions of the best one
+            return countsToProbs(max(solved, key=lambda x: x[0])[1].tolist(), temp)
+        counts = np.sum(counts, axis=0)
+        if counts.sum() == 0:
+            # no action was visited (e.g. a single simulation per worker only expanded the root)
+            counts = np.array(self.game.getValidMoves(canonicalBoard, 1))
+        return countsToProbs(counts.tolist(), temp)
+
+    def close(self):
+        for pool in self.pools:
+            pool.close()
+        for pool in self.pools:
+            pool.join()
+        if os.path.isfile(self.checkpointFile):
+            os.remove(self.checkpointFile)
+
+
+class TreeParallelMCTS(MCTS):
+    """
+    Tree-parallel MCTS: args.numMCTSThreads (default 4) threads run
+    simulations on one shared tree.
+
+    Every descent adds a virtual loss of args.virtualLoss (default 1) to the
+    edges it takes, so that concurrent descents spread over different paths.
+    Selection, expansion and backup hold the tree lock, the network is called
+    without it, so that threads overlap inference (which releases the GIL in
+    e.g. the PyTorch wrappers) with the tree work of the other threads. A
+    thread reaching a leaf that another thread is evaluating waits for it to
+    be expanded and descends again.
+    """
+
+    def __init__(self, game, nnet, args):
+        super().__init__(game, nnet, args)
+        self.numThreads = args.get('numMCTSThreads', 4)
+        self.lock = threading.Lock()
+        self.expanded = threading.Condition(self.lock)  # notified whenever a leaf is expanded
+        self.pending = set()  # leaves being evaluated
+        self.executor = ThreadPoolExecutor(self.numThreads)
+
+    def search(self, canonicalBoard):
+        """
+        This function performs one iteration of MCTS, see MCTS.search. It can
+        be called from several threads at once.
+
+        Returns:
+            v: the negative of the value of the current canonicalBoard
+        """
+        virtualLoss = self.args.get('virtualLoss', 1)
+        with self.lock:
+            self.stamp += 1
+            while True:
+                path, s, board, v = self._descend(canonicalBoard, virtualLoss)
+                if v is not None or s not in self.pending:
+                    break
+                # another thread is evaluating this leaf
+                self._revertVirtualLoss(path, virtualLoss)
+                self.expanded.wait()
+            if v is None:
+                v = self._expandCached(s)
+            isLeaf = v is None
+            if isLeaf:
+                self.pending.add(s)
+
+        if isLeaf:
+            # leaf node
+            try:
+                clock = time.perf_counter()
+                pi, v = self.nnet.predict(encode_board(board))
+                seconds = time.perf_counter() - clock
+            except BaseException:
+                # release the threads waiting for this leaf, the next descent evaluates it again
+                with self.lock:
+                    self._revertVirtualLoss(path, virtualLoss)
+                    self.pending.discard(s)
+                    self.expanded.notify_all()
+                raise
+
+        with self.lock:
+            if isLeaf:
+                try:
+                    self._countNetwork(1, seconds)
+                    v = self._expand(s, board, pi, v)
+                finally:
+                    self.pending.discard(s)
+                    self.expanded.notify_all()
+            v = self._backup(path, v, virtualLoss)
+            self._evict()
+        return -v
+
+    def _simulate(self, canonicalBoard, maxSims):
+        """
+        Runs one round of at most numMCTSThreads * 4 simulations, shared by
+        the threads.
+
+        Returns:
+            sims: the number of simulations performed
+        """
+        sims = min(self.numThreads * 4, maxSims)
+        remaining = [sims]
+
+        def worker():
+            while True:
+                with self.lock:
+                    if remaining[0] == 0:
+                        return
+                    remaining[0] -= 1
+                self.search(canonicalBoard)
+
+        for future in [self.executor.submit(worker) for _ in range(min(self.numThreads, sims))]:
+            future.result()
+        return sims
+
+    def close(self):
+        self.executor.shutdown()
@@ -0,0 +1,352 @@
+from collections import deque
+
+import numpy as np
+
+from ExampleCodec import CHUNK_SIZE, addPolicies, densePolicies, indexDtype, isTernary, packBoards, policyWidth, \
+    sparsePolicies, unpackBoards
+
+
+class ReplayBuffer():
+    """
+    Training examples (board, pi, v) stored in preallocated arrays used as a
+    ring buffer: boards as int8 (float32 if they are not small integers),
+    policies as piDtype (default float16) and values as float32.
+
+    Examples are added one iteration of self-play at a time. The buffer holds
+    at most capacity examples, overwriting the oldest ones, and only the
+    examples of the latest window iterations (all if window is None).
+
+    Indexing and iterating give the examples as (board, pi, v) tuples, oldest
+    first, so that the buffer can stand in for a list of examples. Networks
+    that know it should use arrays() or sample() instead.
+
+    If compact, ternary boards are stored bit-packed and policies as their
+    nonzero entries, see ExampleCodec; examples are decoded when they are
+    read. Other boards are stored as above.
+
+    If a game is given, the buffer holds one example per position and
+    arrays() and sample() augment them with game.getSymmetries, in place of
+    storing every symmetrical form of the position.
+
+    A buffer made by deduplicated() weighs every example by the number of
+    examples merged into it: sample() draws them in proportion to it, and
+    weights() gives it to networks that train on arrays().
+    """
+
+    def __init__(self, capacity, window=None, piDtype=np.float16, game=None, compact=False):
+        self.capacity = capacity
+        self.window = window
+        self.piDtype = piDtype
+        self.game = game  # whose symmetries are applied to the examples read, None for no augmentation
+        self.compact = compact
+        self.boardShape = None
+        self.actionSize = None
+        self.boards = None  # allocated by the first add, when the shapes are known; bit-packed if compact
+        self.pis = None  # None if compact
+        self.piIndices = None  # the sparse policies if compact
+        self.piValues = None
+        self.vs = None
+        self.start = 0  # position of the oldest example
+        self.size = 0
+        self.iterationSizes = deque()  # number of examples still held of every iteration, oldest first
+        self.counts = None  # number of examples merged into each example, set by deduplicated
+
+    def addIteration(self, examples):
+        """
+        Adds the examples of a new iteration, then drops the iterations that
+        fall out of the window.
+
+        Input:
+            examples: a list of examples of the form (board, pi, v)
+        """
+        self.iterationSizes.append(0)
+        if len(examples) > 0:
+            boards, pis, vs = zip(*examples)
+            self.add(np.array(boards), np.array(pis), np.array(vs))
+        while self.window is not None and len(self.iterationSizes) > self.window:
+            self._drop(self.iterationSizes[0])
+            self.iterationSizes.popleft()
+
+    def add(self, boards, pis, vs):
+        """
+        Adds examples to the latest iteration, given as stacked arrays.
+        """
+        if not self.iterationSizes:
+            self.iterationSizes.append(0)
+        if self.boards is None:
+            self._allocate(boards, pis)
+        if self.compact and not isTernary(boards):
+            raise ValueError('Boards are not ternary, the buffer was created to bit-pack ternary boards')
+        if self.boards.dtype == np.int8 and (boards.min() < -128 or boards.max() > 127):
+            raise ValueError('Boards do not fit in int8, the buffer was created for small integer boards')
+
+        for offset in range(0, len(boards), self.capacity):
+            # more examples than the capacity only keep the last ones
+            self._write(boards[offset:offset + self.capacity], pis[offset:offset + self.capacity],
+                        vs[offset:offset + self.capacity])
+
+    def _allocate(self, boards, pis):
+        self.boardShape = boards.shape[1:]
+        self.actionSize = pis.shape[1]
+        self.vs = np.zeros(self.capacity, dtype=np.float32)
+        # only ternary boards can be bit-packed, others are kept dense
+        self.compact = self.compact and isTernary(boards) and pis.ndim == 2
+        if self.compact:
+            packed = packBoards(boards[:1])
+            self.boards = np.zeros((self.capacity,) + packed.shape[1:], dtype=np.uint8)
+            width = max(policyWidth(pis), 1)
+            self.piIndices = np.zeros((self.capacity, width), dtype=indexDtype(self.actionSize))
+            self.piValues = np.zeros((self.capacity, width), dtype=self.piDtype)
+            return
+        small = np.issubdtype(boards.dtype, np.integer) and boards.min() >= -128 and boards.max() <= 127
+        self.boards = np.zeros((self.capacity,) + boards.shape[1:], dtype=np.int8 if small else np.float32)
+        self.pis = np.zeros((self.capacity,) + pis.shape[1:], dtype=self.piDtype)
+
+    def _write(self, boards, pis, vs):
+        n = len(boards)
+        if self.size + n > self.capacity:
+            self._drop(self.size + n - self.capacity)
+        positions = (self.start + self.size + np.arange(n)) % self.capacity
+        self._store(positions, boards, pis)
+        self.vs[positions] = np.asarray(vs).reshape(n)
+        self.size += n
+        self.iterationSizes[-1] += n
+
+    def _store(self, positions, boards, pis):
+        if not self.compact:
+            self.boards[positions] = boards
+            self.pis[positions] = pis
+            return
+        self.boards[positions] = packBoards(boards)
+        width = policyWidth(pis)
+        if width > self.piIndices.shape[1]:
+            # pad with zero values, which densePolicies skips
+            padding = width - self.piIndices.shape[1]
+            self.piIndices = np.pad(self.piIndices, ((0, 0), (0, padding)))
+            self.piValues = np.pad(self.piValues, ((0, 0), (0, padding)))
+        self.piIndices[positions], self.piValues[positions] = sparsePolicies(pis, self.piIndices.shape[1],
+                                                                             self.piDtype)
+
+    def _readBoards(self, positions):
+        if not self.compact:
+            return self.boards[positions]
+        return unpackBoards(self.boards[positions], self.boardShape)
+
+    def _readPolicies(self, positions, dtype=np.float32):
+        if not self.compact:
+            return self.pis[positions].astype(dtype)
+        return densePolicies(self.piIndices[positions], self.piValues[positions], self.actionSize, dtype)
+
+    def _drop(self, n):
+        """
+        Drops the n oldest examples.
+        """
+        self.start = (self.start + n) % self.capacity
+        self.size -= n
+        while n > 0:
+            dropped = min(n, self.iterationSizes[0])
+            self.iterationSizes[0] -= dropped
+            n -= dropped
+            if self.iterationSizes[0] == 0 and n > 0:
+                self.iterationSizes.popleft()
+
+    def numIterations(self):
+        return len(self.iterationSizes)
+
+    def arrays(self):
+        """
+        Returns:
+            boards, pis, vs: arrays holding all examples, not in any
+                             particular order. They are views of the buffer
+                             unless the examples wrap around its end or are
+                             augmented, with a random symmetry each.
+        """
+        end = self.start + self.size
+        if end <= self.capacity and not self.compact:
+            boards, pis, vs = self.boards[self.start:end], self.pis[self.start:end], self.vs[self.start:end]
+        else:
+            positions = self._positions(np.arange(self.size))
+            boards, pis, vs = self._readBoards(positions), self._readPolicies(positions, self.piDtype), \
+                self.vs[positions]
+        if self.game is None:
+            return boards, pis, vs
+        symmetries = np.random.randint(self._numSymmetries(), size=len(boards))
+        boards, pis = self._applySymmetries(boards, pis.astype(np.float32), symmetries)
+        return boards, pis, vs
+
+    def latestIteration(self):
+        """
+        Returns:
+            boards, pis, vs: arrays holding the examples still held of the
+                             latest iteration, in order
+        """
+        latest = self.iterationSizes[-1] if self.iterationSizes else 0
+        if latest == 0:
+            return None, None, None
+        positions = self._positions(np.arange(self.size - latest, self.size))
+        return self._readBoards(positions), self._readPolicies(positions, self.piDtype), self.vs[positions]
+
+    def deduplicated(self):
+        """
+        Merges the examples of the same board into one example, whose policy
+        and value are the means of the merged ones. Boards are compared as
+        stored, so symmetrical forms of a position are kept apart.
+
+        Returns:
+            replayBuffer: a new ReplayBuffer with one example per distinct
+                          board, in a single iteration, with the number of
+                          examples merged into each in counts
+        """
+        if self.size == 0:
+            return self
+        positions = self._positions(np.arange(self.size))
+        # the stored boards, bit-packed or not, are equal exactly when the boards are
+        _, first, inverse, counts = np.unique(self.boards[positions].reshape(self.size, -1), axis=0,
+                                             return_index=True, return_inverse=True, return_counts=True)
+        inverse = inverse.reshape(-1)
+        vs = np.bincount(inverse, weights=self.vs[positions], minlength=len(counts)) / counts
+
+        # merge a chunk of boards at a time, reading their examples in the order of the merged boards
+        order = np.argsort(inverse, kind='stable')
+        ends = np.cumsum(counts)
+        merged = ReplayBuffer(len(counts), piDtype=self.piDtype, game=self.game, compact=self.compact)
+        for start in range(0, len(counts), CHUNK_SIZE):
+            stop = min(start + CHUNK_SIZE, len(counts))
+            examples = order[ends[start] - counts[start]:ends[stop - 1]]
+            rows = inverse[examples] - start
+            pis = np.zeros((stop - start,) + ((self.actionSize,) if self.compact else self.pis.shape[1:]),
+                           dtype=np.float32)
+            if self.compact:
+                addPolicies(pis, rows, self.piIndices[positions[examples]], self.piValues[positions[examples]])
+            else:
+                np.add.at(pis, rows, self.pis[positions[examples]].astype(np.float32))
+            pis /= counts[start:stop].reshape((-1,) + (1,) * (pis.ndim - 1))
+            merged.add(self._readBoards(positions[first[start:stop]]), pis, vs[start:stop])
+        merged.counts = counts
+        return merged
+
+    def weights(self):
+        """
+        Returns:
+            weights: float32 array with the training weight of every example,
+                     in the order of arrays(): the number of examples merged
+                     into it scaled to a mean of 1, or None if the examples
+                     were not merged
+        """
+        if self.counts is None:
+            return None
+        return (self.counts * (len(self.counts) / self.counts.sum())).astype(np.float32)
+
+    def sample(self, batchSize):
+        """
+        Returns:
+            boards, pis, vs: arrays of batchSize examples drawn at random
+                             (with replacement), uniformly or in proportion
+                             to counts, with float32 policies. If augmented,
+                             one random symmetry is applied to the whole
+                             batch.
+        """
+        if self.counts is None:
+            indices = np.random.randint(self.size, size=batchSize)
+        else:
+            indices = np.random.choice(self.size, size=batchSize, p=self.counts / self.counts.sum())
+        positions = self._positions(indices)
+        boards, pis, vs = self._readBoards(positions), self._readPolicies(positions), self.vs[positions]
+        if self.game is None:
+            return boards, pis, vs
+        symmetries = np.full(batchSize, np.random.randint(self._numSymmetries()))
+        boards, pis = self._applySymmetries(boards, pis, symmetries)
+        return boards, pis, vs
+
+    def _numSymmetries(self):
+        positions = np.array([self.start])
+        return len(self.game.getSymmetries(self._readBoards(positions)[0], self._readPolicies(positions)[0]))
+
+    def _applySymmetries(self, boards, pis, symmetries):
+        """
+        Returns boards and pis with the symmetries[i]-th form given by
+        game.getSymmetries applied to the i-th example.
+        """
+        boards, pis = boards.copy(), pis.copy()
+        for i in range(len(boards)):
+            board, pi = self.game.getSymmetries(boards[i], pis[i])[symmetries[i]]
+            boards[i] = board
+            pis[i] = pi
+        return boards, pis
+
+    def _positions(self, indices):
+        return (self.start + indices) % self.capacity
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if not -self.size <= i < self.size:
+            raise IndexError('ReplayBuffer index out of range')
+        positions = self._positions(np.array([i % self.size]))
+        return self._readBoards(positions)[0], self._readPolicies(positions)[0], float(self.vs[positions[0]])
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self[i]
+
+    def _storedNames(self):
+        return ('boards', 'piIndices', 'piValues', 'vs') if self.compact else ('boards', 'pis', 'vs')
+
+    def __getstate__(self):
+        # only pickle the examples held, in order
+        state = self.__dict__.copy()
+        state['game'] = None
+        if self.boards is not None:
+            positions = self._positions(np.arange(self.size))
+            state.update({name: getattr(self, name)[positions] for name in self._storedNames()}, start=0)
+        return state
+
+    def __setstate__(self, state):
+        # buffers pickled before compact storage have dense arrays only
+        self.__dict__.update(compact=False, boardShape=None, actionSize=None, piIndices=None, piValues=None,
+                             counts=None)
+        self.__dict__.update(state)
+        self.game = state.get('game')
+        if self.boards is not None:
+            for name in self._storedNames():
+                held = getattr(self, name)
+                full = np.zeros((self.capacity,) + held.shape[1:], dtype=held.dtype)
+                full[:self.size] = held
+                setattr(self, name, full)
+
+
+def stackExamples(examples):
+    """
+    Returns:
+        boards, pis, vs: arrays stacking all examples, given as a ReplayBuffer
+                         or as a list of examples of the form (board, pi, v)
+    """
+    if isinstance(examples, ReplayBuffer):
+        return examples.arrays()
+    boards, pis, vs = list(zip(*examples))
+    return np.asarray(boards), np.asarray(pis), np.asarray(vs)
+
+
+def exampleWeights(examples):
+    """
+    Returns:
+        weights: the training weights of the examples stacked by
+                 stackExamples, see ReplayBuffer.weights, or None to weigh
+                 them all the same
+    """
+    if isinstance(examples, ReplayBuffer):
+        return examples.weights()
+    return None
+
+
+def sampleExamples(examples, batchSize):
+    """
+    Returns:
+        boards, pis, vs: batchSize examples drawn uniformly at random (with
+                         replacement) from a ReplayBuffer or a list of examples
+    """
+    if isinstance(examples, ReplayBuffer):
+        return examples.sample(batchSize)
+    sample_ids = np.random.randint(len(examples), size=batchSize)
+    return list(zip(*[examples[i] for i in sample_ids]))
@@ -1,4 +1,5 @@
 import chess
+import chess.polyglot
 import numpy as np
 
 from Game import Game
@@ -61,6 +62,30 @@ class ChessGame(Game):
 
         return b, -player
 
+    def apply(self, board: chess.Board, action):
+        # push the move, then mirror the board to the side to move. Board.apply_mirror would
+        # clear the move stack, so the position is mirrored by hand and undo can pop the move
+        move = to_move(action)
+        if not board.turn:
+            move = mirror_move(move)
+        board.push(move)
+        self._mirrorInPlace(board)
+        return None
+
+    def undo(self, board: chess.Board, token):
+        self._mirrorInPlace(board)
+        board.pop()
+
+    @staticmethod
+    def _mirrorInPlace(board: chess.Board):
+        chess.BaseBoard.apply_transform(board, chess.flip_vertical)
+        board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK] = \
+            board.occupied_co[chess.BLACK], board.occupied_co[chess.WHITE]
+        board.turn = not board.turn
+        board.castling_rights = chess.flip_vertical(board.castling_rights)
+        if board.ep_square is not None:
+            board.ep_square = chess.square_mirror(board.ep_square)
+
     def getValidMoves(self, board: chess.Board, player):
         valid_moves = np.zeros(shape=(self.getActionSize()))
 
@@ -89,6 +114,13 @@ class ChessGame(Game):
     def stringRepresentation(self, board: chess.Board):
         return board.fen()
 
+    def hashKey(self, board: chess.Board):
+        # 64-bit polyglot zobrist hash, much cheaper than the fen
+        return chess.polyglot.zobrist_hash(board)
+
+    def getDrawValue(self):
+        return 0.5
+
     # for i, piece_name in enumerate(["K", "Q", "B", "N", "R", "P"]):
     #     section = encoded_board[i * 8: i * 8 + 8]
     #
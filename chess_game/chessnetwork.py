@@ -1,6 +1,5 @@
 import os
 
-import numpy as np
 from keras import Model, Sequential, Input
 from keras.layers import Dense, Reshape, Activation, BatchNormalization, Conv2D, Flatten, Dropout
 from keras.optimizer_v2.adam import Adam
@@ -8,6 +7,7 @@ import tensorflow as tf
 from numpy import ndarray
 
 from NeuralNet import NeuralNet
+from ReplayBuffer import exampleWeights, stackExamples
 from chess_game.ChessGame import ChessGame
 from utils import dotdict
 
@@ -31,29 +31,37 @@ class ChessNetwork(NeuralNet):
         self.model = self.get_model(game.getBoardSize(), game.getActionSize(), args)
 
     def train(self, examples):
-        input_boards, target_pis, target_vs = list(zip(*examples))
-        input_boards = np.asarray(input_boards)
-        target_pis = np.asarray(target_pis)
-        target_vs = np.asarray(target_vs)
+        input_boards, target_pis, target_vs = stackExamples(examples)
         history = self.model.fit(
             x=input_boards,
             y=[target_pis, target_vs],
             batch_size=args.batch_size,
             epochs=args.epochs,
             verbose=0,
+            sample_weight=exampleWeights(examples),
         )
         return history.history["pi_loss"][-1], history.history["v_loss"][-1]
 
     def predict(self, board):
         """
-                board: np array with board
-                """
+        board: np array with board
+        """
 
         prep_board = ndarray.reshape(board, (1, 6, 8, 8))
         # run
         pi, v = self.model.predict(prep_board)
         return pi[0], v[0]
 
+    def predict_batch(self, boards):
+        """
+        boards: np array with a batch of boards
+        """
+
+        prep_boards = ndarray.reshape(boards, (-1, 6, 8, 8))
+        # run
+        pis, vs = self.model.predict(prep_boards)
+        return pis, vs
+
     def save_checkpoint(
             self, folder="checkpoint", filename="checkpoint.pth.tar"
     ):
@@ -30,6 +30,17 @@ class Connect4Game(Game):
         b.add_stone(action, player)
         return b.np_pieces, -player
 
+    def apply(self, board, action):
+        """In-place getNextState followed by getCanonicalForm: drop the stone and flip the colors."""
+        row = np.flatnonzero(board[:, action] == 0)[-1]
+        board[row, action] = 1
+        np.negative(board, out=board)
+        return row, action
+
+    def undo(self, board, token):
+        np.negative(board, out=board)
+        board[token] = 0
+
     def getValidMoves(self, board, player):
         "Any zero value in top row in a valid move"
         return self._base_board.with_np_pieces(np_pieces=board).get_valid_moves()
@@ -62,6 +73,10 @@ class Connect4Game(Game):
     def stringRepresentation(self, board):
         return board.tostring()
 
+    def hashKey(self, board):
+        # 64-bit integer key for MCTS, smaller than the bytes of the board
+        return hash(board.tobytes())
+
     @staticmethod
     def display(board):
         print(" -----------------------")
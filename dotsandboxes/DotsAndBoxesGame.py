@@ -108,6 +108,10 @@ class DotsAndBoxesGame(Game):
         # 8x8 numpy array (canonical board)
         return board.tostring()
 
+    def hashKey(self, board):
+        # 64-bit integer key for MCTS, smaller than the bytes of the board
+        return hash(board.tobytes())
+
     @staticmethod
     def display(board):
         n = board.shape[1]
@@ -39,6 +39,7 @@ def predict():
 if __name__ == '__main__':
     g = DotsAndBoxesGame(n=3)
     n1 = NNetWrapper(g)
-    mcts = MCTS(g, n1, dotdict({'numMCTSSims': 50, 'cpuct': 1.0}))
+    mcts = MCTS(g, n1, dotdict({'numMCTSSims': 50, 'cpuct': 1.0, 'maxTreeNodes': 100000,
+                                'timeBudgetMs': 1000, 'earlyStop': True, 'useSolver': True}))
     n1.load_checkpoint(os.path.join('..', 'pretrained_models', 'dotsandboxes', 'keras', '3x3'), 'best.pth.tar')
     app.run(debug=False, host='0.0.0.0', port=8888)
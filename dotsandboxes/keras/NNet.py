@@ -4,6 +4,7 @@ import os
 sys.path.append('..')
 from utils import dotdict
 from NeuralNet import NeuralNet
+from ReplayBuffer import exampleWeights, stackExamples
 
 from .DotsAndBoxesNNet import DotsAndBoxesNNet as onnet
 
@@ -44,14 +45,13 @@ class NNetWrapper(NeuralNet):
         """
         examples: list of examples, each example is of form (board, pi, v)
         """
-        input_boards, target_pis, target_vs = list(zip(*examples))
-        input_boards = np.asarray(input_boards)
+        input_boards, target_pis, target_vs = stackExamples(examples)
+        # normalize_score works in place, keep the stored examples intact
+        input_boards = np.array(input_boards)
 
         normalize_score(input_boards)
 
-        target_pis = np.asarray(target_pis)
-        target_vs = np.asarray(target_vs)
-        self.nnet.model.fit(x=input_boards, y=[target_pis, target_vs], batch_size=args.batch_size, epochs=args.epochs)
+        self.nnet.model.fit(x=input_boards, y=[target_pis, target_vs], batch_size=args.batch_size, epochs=args.epochs, sample_weight=exampleWeights(examples))
 
     def predict(self, board):
         """
@@ -36,6 +36,18 @@ class GobangGame(Game):
         return (b.pieces, -player)
 
     # modified
+    def apply(self, board, action):
+        # in-place getNextState followed by getCanonicalForm: place the stone and flip the colors
+        if action != self.n*self.n:
+            board[int(action/self.n)][action%self.n] = 1
+        np.negative(board, out=board)
+        return action
+
+    def undo(self, board, action):
+        np.negative(board, out=board)
+        if action != self.n*self.n:
+            board[int(action/self.n)][action%self.n] = 0
+
     def getValidMoves(self, board, player):
         # return a fixed size binary vector
         valids = [0] * self.getActionSize()
@@ -100,6 +112,10 @@ class GobangGame(Game):
         # 8x8 numpy array (canonical board)
         return board.tostring()
 
+    def hashKey(self, board):
+        # 64-bit integer key for MCTS, smaller than the bytes of the board
+        return hash(board.tobytes())
+
     @staticmethod
     def display(board):
         n = board.shape[0]
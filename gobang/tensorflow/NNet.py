@@ -7,6 +7,7 @@ from tqdm import tqdm
 sys.path.append('../../')
 from utils import *
 from NeuralNet import NeuralNet
+from ReplayBuffer import sampleExamples
 
 import tensorflow as tf
 from .GobangNNet import GobangNNet as onnet
@@ -46,8 +47,7 @@ class NNetWrapper(NeuralNet):
             # self.sess.run(tf.local_variables_initializer())
             t = tqdm(range(batch_count), desc='Training Net')
             for _ in t:
-                sample_ids = np.random.randint(len(examples), size=args.batch_size)
-                boards, pis, vs = list(zip(*[examples[i] for i in sample_ids]))
+                boards, pis, vs = sampleExamples(examples, args.batch_size)
 
                 # predict and compute gradient and do SGD step
                 input_dict = {self.nnet.input_boards: boards, self.nnet.target_pis: pis, self.nnet.target_vs: vs,
@@ -7,25 +7,37 @@ from chess_game.ChessGame import ChessGame
 from chess_game.chessnetwork import ChessNetwork as nn
 from utils import *
 
-import resource, sys
-
 log = logging.getLogger(__name__)
 
 coloredlogs.install(level='INFO')  # Change this to DEBUG to see more info.
 
-
-resource.setrlimit(resource.RLIMIT_STACK, (2 ** 29, -1))
-sys.setrecursionlimit(10 ** 6)
 args = dotdict({
     'numIters': 100,
     'numEps': 100,  # Number of complete self-play games to simulate during a new iteration.
+    'selfPlayBatchSize': 1,  # Number of self-play games played in lockstep, sharing batched network calls.
+    'numSelfPlayWorkers': 1,  # Number of processes playing the self-play games.
+    'pipelineSelfPlay': False,  # Let the self-play processes play the next iteration during training.
     'tempThreshold': 15,  #
     'updateThreshold': 0.6,
     # During arena playoff, new neural net will be accepted if threshold or more of games are won.
     'maxlenOfQueue': 200000,  # Number of game examples to train the neural networks.
+    'replayBufferSize': 200000,  # Number of examples kept for training, over all iterations of the history.
+    'sampleSymmetries': True,  # Store one example per self-play move and apply the game symmetries when sampling.
+    'dedupExamples': False,  # Train on one example per distinct board, averaging the targets of its repetitions.
+    'compactExamples': True,  # Keep the examples with bit-packed boards and sparse policies, decoded when sampled.
     'numMCTSSims': 25,  # Number of games moves for MCTS to simulate.
+    'playoutCapProb': 1,  # Fraction of self-play moves searched with numMCTSSims and recorded, the others use numMCTSSimsFast.
+    'numMCTSSimsFast': 5,  # Number of simulations of the unrecorded self-play moves.
     'arenaCompare': 40,  # Number of games to play during arena play to determine if new net will be accepted.
+    'numMCTSWorkers': 1,  # Number of processes running a root-parallel MCTS for each arena player.
+    'numArenaWorkers': 1,  # Number of processes playing the arena games, each with its own copy of both networks.
     'cpuct': 1,
+    'leafBatchSize': 1,  # Number of MCTS leaves evaluated together in one batched network call.
+    'reuseTree': True,  # Keep the subtree of the position reached between moves, and free the rest.
+    'useSolver': True,  # Propagate proven wins/losses/draws through the MCTS tree and stop searching solved positions.
+    'earlyStop': True,  # Stop MCTS with temp=0 as soon as the most visited move cannot be overtaken.
+    'maxTreeNodes': None,  # Evict least recently visited MCTS nodes beyond this many (None for no limit).
+    'evalCacheSize': 100000,  # Number of network evaluations cached across the MCTS of a process (None to disable).
 
     'checkpoint': './temp/',
     'load_model': False,
@@ -92,6 +92,10 @@ class OthelloGame(Game):
     def stringRepresentation(self, board):
         return board.tostring()
 
+    def hashKey(self, board):
+        # 64-bit integer key for MCTS, smaller than the bytes of the board
+        return hash(board.tobytes())
+
     def stringRepresentationReadable(self, board):
         board_s = "".join(self.square_content[square] for row in board for square in row)
         return board_s
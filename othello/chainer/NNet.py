@@ -14,6 +14,7 @@ from tqdm import tqdm
 sys.path.append('../../')
 from utils import *
 from NeuralNet import NeuralNet
+from ReplayBuffer import sampleExamples
 from .OthelloNNet import OthelloNNet as onnet
 
 args = dotdict({
@@ -103,8 +104,7 @@ class NNetWrapper(NeuralNet):
 
             t = tqdm(range(batch_count), desc='Training Net')
             for _ in t:
-                sample_ids = np.random.randint(len(examples), size=args.batch_size)
-                boards, pis, vs = list(zip(*[examples[i] for i in sample_ids]))
+                boards, pis, vs = sampleExamples(examples, args.batch_size)
                 xp = self.nnet.xp
                 boards = xp.array(boards, dtype=xp.float32)
                 target_pis = xp.array(pis, dtype=xp.float32)
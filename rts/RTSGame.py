@@ -193,6 +193,10 @@ class RTSGame:
     def stringRepresentation(self, board: np.ndarray):
         return board.tostring()
 
+    def hashKey(self, board):
+        # 64-bit integer key for MCTS, smaller than the bytes of the board
+        return hash(board.tobytes())
+
     def getScore(self, board: np.array, player: int):
         """
         Uses one of 3 elo functions that determine better player
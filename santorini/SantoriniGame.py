@@ -360,6 +360,10 @@ class SantoriniGame(Game):
     def stringRepresentation(self, board):
         return board.tostring()
 
+    def hashKey(self, board):
+        # 64-bit integer key for MCTS, smaller than the bytes of the board
+        return hash(board.tobytes())
+
     def stringRepresentationReadable(self, board):
         # Do not think this works.
         board_s = "".join(self.square_content[square] for row in board for square in row)
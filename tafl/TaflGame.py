@@ -84,6 +84,10 @@ class TaflGame(Game):
         #print("->",str(board))
         return str(board)
 
+    def hashKey(self, board):
+        # zobrist hash, updated incrementally by the moves
+        return board.getHash()
+
     def getScore(self, board, player):
         if board.done: return 1000*board.done*player
         return board.countDiff(player)
@@ -1,6 +1,19 @@
 import numpy as np
 from .GameVariants import Tafl
 
+_zobristTables = {}
+
+def zobristTable(size):
+    """Returns random 64-bit keys [x][y][type] for the pieces (types -1, 1 and 2)
+    of a size x size board, and the key of the side to move"""
+    if size not in _zobristTables:
+        rng = np.random.RandomState(size)
+        keys = rng.randint(0, 2**62, size=(size, size, 3), dtype=np.int64).tolist()
+        _zobristTables[size] = (keys, int(rng.randint(0, 2**62, dtype=np.int64)))
+    return _zobristTables[size]
+
+_pieceIndex = {-1: 0, 1: 1, 2: 2}
+
 class Board():
 
 
@@ -12,6 +25,7 @@ class Board():
       self.pieces=gv.pieces #[x,y,type]
       self.time=0
       self.done=0
+      self.zobrist=None #computed on first use by getHash, then kept up to date by _moveByPieceNo
 
     def __str__(self):
         return str(self.getPlayerToMove()) + ''.join(str(r) for v in self.getImage() for r in v) 
@@ -31,8 +45,19 @@ class Board():
       b = Board(gv)
       b.time=self.time
       b.done=self.done
+      b.zobrist=self.zobrist
       return b
 
+    def getHash(self):
+        """Zobrist hash of the pieces and the player to move"""
+        if self.zobrist is None:
+            keys, black = zobristTable(self.size)
+            h = black if self.time%2 == 1 else 0
+            for piece in self.pieces:
+                if piece[0] >= 0: h ^= keys[piece[0]][piece[1]][_pieceIndex[piece[2]]]
+            self.zobrist = h
+        return self.zobrist
+
 
     def countDiff(self, color):
         """Counts the # pieces of the given color
@@ -140,11 +165,16 @@ class Board():
       self.time = self.time + 1
 
       piece=self.pieces[pieceno]
+      if self.zobrist is not None:
+          keys, black = zobristTable(self.size)
+          k = _pieceIndex[piece[2]]
+          self.zobrist ^= black ^ keys[piece[0]][piece[1]][k] ^ keys[x2][y2][k]
       piece[0]=x2
       piece[1]=y2
       caps = self._getCaptures(pieceno,x2,y2)
       #print("Captures = ",caps)
       for c in caps:
+          if self.zobrist is not None: self.zobrist ^= keys[c[0]][c[1]][_pieceIndex[c[2]]]
           c[0]=-99
 
       self.done = self._getWinLose()
@@ -0,0 +1,578 @@
+"""
+Unit tests for MCTS. They use ChessGame together with a small deterministic
+network, so no deep learning framework has to be installed.
+
+To run tests:
+pytest test_mcts.py
+"""
+
+import asyncio
+import functools
+import math
+import os
+import tempfile
+import zlib
+import unittest
+from unittest import mock
+
+import chess
+import numpy as np
+
+from Arena import Arena
+from AsyncMCTS import AsyncMCTS, BatchEvaluator
+from Coach import Coach, _arenaPlayers
+from MCTS import MCTS, EPS
+from NeuralNet import NeuralNet
+from ParallelMCTS import RootParallelMCTS, TreeParallelMCTS
+from chess_game.ChessGame import ChessGame
+from utils import dotdict, encode_board
+
+
+class HashNNet(NeuralNet):
+    """
+    A deterministic stand-in for a NeuralNet: the policy and value are derived
+    from the encoded board, so different positions get different predictions.
+    """
+
+    def __init__(self, game):
+        self.action_size = game.getActionSize()
+        self.batch_sizes = []
+
+    def predict_batch(self, boards):
+        self.batch_sizes.append(len(boards))
+        return super().predict_batch(boards)
+
+    def predict(self, board):
+        rng = np.random.RandomState(zlib.crc32(board.tobytes()))
+        pi = rng.random_sample(self.action_size)
+        return pi / np.sum(pi), np.array([rng.uniform(-1, 1)])
+
+    def load_checkpoint(self, folder, filename):
+        # nothing to load, but gives the network a new modelVersion
+        pass
+
+
+class SavingHashNNet(HashNNet):
+    """
+    A HashNNet whose checkpoints are empty files.
+    """
+
+    def save_checkpoint(self, folder, filename):
+        open(os.path.join(folder, filename), 'w').close()
+
+
+class FailingHashNNet(HashNNet):
+    """
+    A HashNNet whose first evaluations raise a RuntimeError.
+    """
+
+    def __init__(self, game, failures):
+        super().__init__(game)
+        self.failures = failures
+
+    def predict(self, board):
+        if self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError('evaluation failed')
+        return super().predict(board)
+
+
+class RecursiveMCTS(MCTS):
+    """
+    The recursive formulation of MCTS.search, kept as a reference.
+    """
+
+    def search(self, canonicalBoard):
+        s = self.hashKey(canonicalBoard)
+        if s not in self.Es:
+            self.Es[s] = self.game.getGameEnded(canonicalBoard, 1)
+        if self.Es[s] != 0:
+            return -self.Es[s]
+
+        node = self.nodes.get(s)
+        if node is None:
+            pi, v = self.nnet.predict(encode_board(canonicalBoard))
+            return -self._expand(s, canonicalBoard, pi, v)
+
+        i = self._selectAction(node)
+        next_s, next_player = self.game.getNextState(canonicalBoard, 1, node.actions[i])
+        v = self.search(self.game.getCanonicalForm(next_s, next_player))
+
+        node.Q[i] = (node.N[i] * node.Q[i] + v) / (node.N[i] + 1)
+        node.N[i] += 1
+        node.n += 1
+        return -v
+
+
+class TestMCTS(unittest.TestCase):
+
+    def setUp(self):
+        self.game = ChessGame()
+        self.args = dotdict({'numMCTSSims': 30, 'cpuct': 1.0})
+
+    def test_select_action_matches_scalar_ucb(self):
+        mcts = MCTS(self.game, HashNNet(self.game), self.args)
+        board = self.game.getInitBoard()
+        mcts.getActionProb(board)
+        node = mcts.nodes[self.game.hashKey(board)]
+
+        cur_best, best_act = -float('inf'), -1
+        for i, a in enumerate(node.actions):
+            if node.N[i] > 0:
+                u = node.Q[i] + self.args.cpuct * node.P[i] * math.sqrt(node.n) / (1 + node.N[i])
+            else:
+                u = self.args.cpuct * node.P[i] * math.sqrt(node.n + EPS)
+            if u > cur_best:
+                cur_best, best_act = u, i
+
+        self.assertEqual(best_act, mcts._selectAction(node))
+
+    def test_action_prob_is_distribution_over_valid_moves(self):
+        mcts = MCTS(self.game, HashNNet(self.game), self.args)
+        board = self.game.getInitBoard()
+        probs = np.array(mcts.getActionProb(board))
+        valids = self.game.getValidMoves(board, 1)
+
+        self.assertAlmostEqual(1.0, probs.sum())
+        self.assertEqual(0, probs[valids == 0].sum())
+        self.assertEqual(self.args.numMCTSSims - 1, mcts.nodes[self.game.hashKey(board)].n)
+
+    def test_num_sims_overrides_args(self):
+        mcts = MCTS(self.game, HashNNet(self.game), self.args)
+        board = self.game.getInitBoard()
+        mcts.getActionProb(board, numSims=5)
+
+        self.assertEqual(4, mcts.nodes[self.game.hashKey(board)].n)
+
+    def test_iterative_search_matches_recursive_search(self):
+        board = self.game.getInitBoard()
+        iterative = MCTS(self.game, HashNNet(self.game), self.args)
+        recursive = RecursiveMCTS(self.game, HashNNet(self.game), self.args)
+        for _ in range(100):
+            self.assertEqual(recursive.search(board), iterative.search(board))
+
+        self.assertEqual(recursive.nodes.keys(), iterative.nodes.keys())
+        for s, node in iterative.nodes.items():
+            self.assertTrue(np.array_equal(recursive.nodes[s].N, node.N))
+            self.assertTrue(np.array_equal(recursive.nodes[s].Q, node.Q))
+
+    def test_reuse_tree_keeps_chosen_subtree_only(self):
+        args = dotdict({'numMCTSSims': 100, 'cpuct': 1.0, 'reuseTree': True})
+        mcts = MCTS(self.game, HashNNet(self.game), args)
+        board = self.game.getInitBoard()
+        action = int(np.argmax(mcts.getActionProb(board, temp=0)))
+        next_board, next_player = self.game.getNextState(board, 1, action)
+        child = self.game.getCanonicalForm(next_board, next_player)
+        s = self.game.hashKey(child)
+        kept = mcts.nodes[s].n
+        self.assertGreater(kept, 0)
+
+        mcts.getActionProb(child)
+        self.assertNotIn(self.game.hashKey(board), mcts.nodes)
+        self.assertEqual(args.numMCTSSims, mcts.nodes[s].n)
+        self.assertEqual(mcts.advanceRoot(child), args.numMCTSSims)
+
+    def test_node_table_stays_within_budget(self):
+        args = dotdict({'numMCTSSims': 200, 'cpuct': 1.0, 'maxTreeNodes': 20})
+        mcts = MCTS(self.game, HashNNet(self.game), args)
+        board = self.game.getInitBoard()
+        mcts.getActionProb(board)
+
+        self.assertLessEqual(len(mcts.nodes), 20)
+        self.assertGreater(mcts.evictions, 0)
+        self.assertIn(self.game.hashKey(board), mcts.nodes)
+        self.assertEqual(sum(mcts._nodeBytes(s, node) for s, node in mcts.nodes.items()) +
+                         sum(mcts._endedBytes(s, e) for s, e in mcts.Es.items()), mcts.residentBytes)
+
+    def test_resident_bytes_follow_growing_nodes(self):
+        # children, virtual loss and proofs grow the nodes after they are added
+        board = chess.Board('r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5Q2/PPPP1PPP/RNB1K1NR w KQkq - 0 1')
+        args = dotdict({'numMCTSSims': 300, 'cpuct': 1.0, 'useSolver': True, 'leafBatchSize': 4,
+                        'maxTreeBytes': 200000})
+        mcts = MCTS(self.game, HashNNet(self.game), args)
+        mcts.getActionProb(board)
+
+        self.assertGreater(mcts.evictions, 0)
+        self.assertLessEqual(mcts.residentBytes, 200000)
+        for node in mcts.nodes.values():
+            self.assertEqual(node.nbytes(), node.counted)
+        self.assertEqual(sum(mcts._nodeBytes(s, node) for s, node in mcts.nodes.items()) +
+                         sum(mcts._endedBytes(s, e) for s, e in mcts.Es.items()), mcts.residentBytes)
+
+    def test_terminal_boards_are_evicted_with_their_parents(self):
+        # white mates with Qf3xf7, which the search keeps reaching
+        board = chess.Board('r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5Q2/PPPP1PPP/RNB1K1NR w KQkq - 0 1')
+        args = dotdict({'numMCTSSims': 1000, 'cpuct': 1.0, 'maxTreeNodes': 20})
+        mcts = MCTS(self.game, HashNNet(self.game), args)
+        mcts.getActionProb(board)
+
+        resident = set(mcts.nodes)
+        for node in mcts.nodes.values():
+            resident.update(node.children.values())
+        self.assertTrue(any(e != 0 for e in mcts.Es.values()))
+        self.assertLessEqual(set(mcts.Es), resident)
+        self.assertEqual(sum(mcts._nodeBytes(s, node) for s, node in mcts.nodes.items()) +
+                         sum(mcts._endedBytes(s, e) for s, e in mcts.Es.items()), mcts.residentBytes)
+
+    def test_early_stop_keeps_best_action(self):
+        board = self.game.getInitBoard()
+        args = dotdict({'numMCTSSims': 200, 'cpuct': 1.0})
+        full = MCTS(self.game, HashNNet(self.game), args)
+        expected = full.getActionProb(board, temp=0)
+
+        args = dotdict({'numMCTSSims': 200, 'cpuct': 1.0, 'earlyStop': True})
+        early = MCTS(self.game, HashNNet(self.game), args)
+        self.assertEqual(expected, early.getActionProb(board, temp=0))
+        s = self.game.hashKey(board)
+        self.assertLess(early.nodes[s].n, full.nodes[s].n)
+
+    def test_early_stop_plays_forced_move(self):
+        board = chess.Board('7k/8/8/8/8/8/1r6/K7 w - - 0 1')
+        args = dotdict({'numMCTSSims': 200, 'cpuct': 1.0, 'earlyStop': True})
+        mcts = MCTS(self.game, HashNNet(self.game), args)
+        probs = mcts.getActionProb(board, temp=0)
+
+        valids = self.game.getValidMoves(board, 1)
+        self.assertEqual(1, valids.sum())
+        self.assertEqual(int(np.argmax(valids)), int(np.argmax(probs)))
+        self.assertEqual(1, mcts.nodes[self.game.hashKey(board)].n)
+
+    def test_time_budget_bounds_search(self):
+        args = dotdict({'numMCTSSims': 10 ** 6, 'cpuct': 1.0})
+        mcts = MCTS(self.game, HashNNet(self.game), args)
+        board = self.game.getInitBoard()
+        mcts.getActionProb(board, timeBudgetMs=50)
+        self.assertLess(mcts.nodes[self.game.hashKey(board)].n, args.numMCTSSims)
+
+    def test_time_budget_with_early_stop_searches_known_root(self):
+        args = dotdict({'numMCTSSims': 10 ** 6, 'cpuct': 1.0, 'earlyStop': True})
+        mcts = MCTS(self.game, HashNNet(self.game), args)
+        board = self.game.getInitBoard()
+        mcts.getActionProb(board, temp=0, timeBudgetMs=100)
+        self.assertGreater(mcts.metrics.sims, 0)
+        mcts.getActionProb(board, temp=0, timeBudgetMs=100)
+        self.assertGreater(mcts.metrics.sims, 0)
+
+    def test_solver_finds_mate_in_one(self):
+        # white mates with Qf3xf7
+        board = chess.Board('r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5Q2/PPPP1PPP/RNB1K1NR w KQkq - 0 1')
+        args = dotdict({'numMCTSSims': 1000, 'cpuct': 1.0, 'useSolver': True})
+        mcts = MCTS(self.game, HashNNet(self.game), args)
+        probs = mcts.getActionProb(board, temp=0)
+
+        root = mcts.nodes[self.game.hashKey(board)]
+        self.assertEqual(1, root.proven)
+        self.assertLess(root.n, args.numMCTSSims)
+        self.assertEqual(1, probs[chess.F3 * 64 + chess.F7])
+
+    def test_batched_search_evaluates_leaves_together(self):
+        nnet = HashNNet(self.game)
+        args = dotdict({'numMCTSSims': 60, 'cpuct': 1.0, 'leafBatchSize': 8})
+        mcts = MCTS(self.game, nnet, args)
+        board = self.game.getInitBoard()
+        probs = mcts.getActionProb(board)
+
+        self.assertAlmostEqual(1.0, sum(probs))
+        self.assertGreater(max(nnet.batch_sizes), 1)
+        self.assertLessEqual(max(nnet.batch_sizes), 8)
+        for node in mcts.nodes.values():
+            self.assertEqual(0, node.vl)
+            self.assertTrue(node.VL is None or not node.VL.any())
+
+    def test_root_parallel_merges_worker_counts(self):
+        args = dotdict({'numMCTSSims': 40, 'cpuct': 1.0, 'numMCTSWorkers': 2})
+        mcts = RootParallelMCTS(self.game, HashNNet(self.game), args)
+        try:
+            board = self.game.getInitBoard()
+            probs = np.array(mcts.getActionProb(board))
+        finally:
+            mcts.close()
+
+        self.assertAlmostEqual(1.0, probs.sum())
+        self.assertEqual(0, probs[self.game.getValidMoves(board, 1) == 0].sum())
+
+    def test_root_parallel_workers_search_once_and_clean_up(self):
+        with tempfile.TemporaryDirectory() as folder:
+            args = dotdict({'numMCTSSims': 20, 'cpuct': 1.0, 'numMCTSWorkers': 3, 'checkpoint': folder})
+            mcts = RootParallelMCTS(self.game, SavingHashNNet(self.game), args)
+            try:
+                self.assertTrue(os.path.isfile(mcts.checkpointFile))
+                mcts.getActionProb(self.game.getInitBoard())
+            finally:
+                mcts.close()
+
+            # every worker ran one search of its share of the simulations
+            self.assertEqual(3, mcts.metrics.searches)
+            self.assertEqual(3 * math.ceil(20 / 3), mcts.metrics.sims)
+            self.assertEqual([], os.listdir(folder))
+
+    def test_root_parallel_counts_visits_kept_under_the_root(self):
+        board = self.game.getInitBoard()
+        valids = self.game.getValidMoves(board, 1)
+        args = dotdict({'numMCTSSims': 20, 'cpuct': 1.0, 'numMCTSWorkers': 2, 'reuseTree': True})
+        mcts = RootParallelMCTS(self.game, HashNNet(self.game), args)
+        try:
+            mcts.getActionProb(board)
+            # the kept visits leave one simulation per worker to the second search
+            probs = mcts.getActionProb(board)
+            self.assertEqual(2, mcts.metrics.sims)
+        finally:
+            mcts.close()
+        self.assertGreater(np.count_nonzero(probs), 2)
+
+        # one simulation per worker only expands the root
+        args = dotdict({'numMCTSSims': 2, 'cpuct': 1.0, 'numMCTSWorkers': 2})
+        mcts = RootParallelMCTS(self.game, HashNNet(self.game), args)
+        try:
+            probs = mcts.getActionProb(board, temp=0)
+        finally:
+            mcts.close()
+        self.assertEqual(1, valids[int(np.argmax(probs))])
+
+    def test_root_parallel_plays_proven_win(self):
+        # white mates with Qf3xf7
+        board = chess.Board('r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5Q2/PPPP1PPP/RNB1K1NR w KQkq - 0 1')
+        args = dotdict({'numMCTSSims': 1000, 'cpuct': 1.0, 'useSolver': True, 'numMCTSWorkers': 2})
+        mcts = RootParallelMCTS(self.game, HashNNet(self.game), args)
+        try:
+            probs = mcts.getActionProb(board, temp=0)
+        finally:
+            mcts.close()
+        self.assertEqual(chess.F3 * 64 + chess.F7, int(np.argmax(probs)))
+
+    def test_tree_parallel_shares_one_tree(self):
+        args = dotdict({'numMCTSSims': 100, 'cpuct': 1.0, 'numMCTSThreads': 4})
+        mcts = TreeParallelMCTS(self.game, HashNNet(self.game), args)
+        board = self.game.getInitBoard()
+        try:
+            probs = mcts.getActionProb(board)
+        finally:
+            mcts.close()
+
+        self.assertAlmostEqual(1.0, sum(probs))
+        self.assertFalse(mcts.pending)
+        self.assertEqual(args.numMCTSSims - 1, mcts.nodes[self.game.hashKey(board)].n)
+        for node in mcts.nodes.values():
+            self.assertEqual(0, node.vl)
+
+    def test_tree_parallel_recovers_from_failed_evaluation(self):
+        # the root evaluation fails while the other threads wait for it
+        args = dotdict({'numMCTSSims': 40, 'cpuct': 1.0, 'numMCTSThreads': 4})
+        mcts = TreeParallelMCTS(self.game, FailingHashNNet(self.game, failures=1), args)
+        board = self.game.getInitBoard()
+        try:
+            with self.assertRaises(RuntimeError):
+                mcts.getActionProb(board)
+            probs = mcts.getActionProb(board)
+        finally:
+            mcts.close()
+
+        self.assertAlmostEqual(1.0, sum(probs))
+        self.assertFalse(mcts.pending)
+        for node in mcts.nodes.values():
+            self.assertEqual(0, node.vl)
+            self.assertTrue(node.VL is None or not node.VL.any())
+
+    def test_async_search_recovers_from_failed_evaluation(self):
+        args = dotdict({'numMCTSSims': 30, 'cpuct': 1.0, 'leafBatchSize': 4})
+        nnet = FailingHashNNet(self.game, failures=0)
+        mcts = AsyncMCTS(self.game, nnet, args)
+        board = self.game.getInitBoard()
+        asyncio.run(mcts.search(board))  # expand the root, so that the failing batch holds deeper leaves
+        nnet.failures = 1
+        with self.assertRaises(RuntimeError):
+            asyncio.run(mcts.getActionProb(board))
+        probs = asyncio.run(mcts.getActionProb(board))
+
+        self.assertAlmostEqual(1.0, sum(probs))
+        self.assertFalse(mcts.pending)
+        for node in mcts.nodes.values():
+            self.assertEqual(0, node.vl)
+            self.assertTrue(node.VL is None or not node.VL.any())
+
+    def test_async_searches_share_batches(self):
+        nnet = HashNNet(self.game)
+        evaluator = BatchEvaluator(nnet)
+        args = dotdict({'numMCTSSims': 30, 'cpuct': 1.0, 'leafBatchSize': 2})
+        searches = [AsyncMCTS(self.game, nnet, args, evaluator) for _ in range(4)]
+        board = self.game.getInitBoard()
+
+        async def play():
+            return await asyncio.gather(*[mcts.getActionProb(board) for mcts in searches])
+
+        for probs in asyncio.run(play()):
+            self.assertAlmostEqual(1.0, sum(probs))
+        self.assertGreater(evaluator.meanBatchSize(), 4)
+        self.assertEqual(evaluator.numBatches, sum(mcts.totalMetrics.networkCalls for mcts in searches))
+        self.assertEqual(evaluator.numBoards, sum(mcts.totalMetrics.networkBoards for mcts in searches))
+        for mcts in searches:
+            self.assertFalse(mcts.pending)
+
+    def test_nodes_store_valid_actions_only(self):
+        mcts = MCTS(self.game, HashNNet(self.game), self.args)
+        board = self.game.getInitBoard()
+        mcts.getActionProb(board)
+        node = mcts.nodes[self.game.hashKey(board)]
+
+        self.assertEqual(20, len(node.actions))
+        self.assertEqual(20, len(node.P))
+        self.assertAlmostEqual(1.0, node.P.sum())
+        self.assertEqual(node.N.tolist(), [mcts.getCounts(board)[a] for a in node.actions])
+
+    def test_metrics_count_search_and_trace_sees_every_board(self):
+        mcts = MCTS(self.game, HashNNet(self.game), self.args)
+        traced = []
+        mcts.trace = lambda board, depth: traced.append(depth)
+        board = self.game.getInitBoard()
+        mcts.getActionProb(board)
+        metrics = mcts.metrics
+
+        self.assertEqual(self.args.numMCTSSims, metrics.sims)
+        self.assertEqual(len(mcts.nodes), metrics.nodesExpanded)
+        self.assertEqual(metrics.nodesExpanded, metrics.networkCalls)
+        self.assertEqual(max(traced), metrics.maxDepth)
+        self.assertEqual(sum(node.n for node in mcts.nodes.values()), len(traced))
+        self.assertGreater(metrics.networkTime, 0)
+
+        mcts.getActionProb(board)
+        self.assertEqual(2, mcts.totalMetrics.searches)
+        self.assertEqual(2 * self.args.numMCTSSims, mcts.totalMetrics.sims)
+
+    def test_eval_cache_is_shared_until_weights_change(self):
+        nnet = HashNNet(self.game)
+        args = dotdict({'numMCTSSims': 30, 'cpuct': 1.0, 'evalCacheSize': 1000})
+        board = self.game.getInitBoard()
+        first = MCTS(self.game, nnet, args)
+        first.getActionProb(board)
+        second = MCTS(self.game, nnet, args)
+        second.getActionProb(board)
+
+        self.assertIs(first.cache, second.cache)
+        self.assertEqual(0, second.metrics.networkCalls)
+        self.assertEqual(first.getCounts(board), second.getCounts(board))
+
+        nnet.load_checkpoint('unused', 'unused')
+        third = MCTS(self.game, nnet, args)
+        third.getActionProb(board)
+        self.assertEqual(first.metrics.networkCalls, third.metrics.networkCalls)
+
+    def test_in_place_descent_matches_copying_descent(self):
+        board = chess.Board()
+        for san in ['e4', 'e5', 'Nf3', 'Nc6']:
+            board.push_san(san)
+        fen, stack = board.fen(), list(board.move_stack)
+        probs = []
+        for applyInPlace in [True, False]:
+            mcts = MCTS(self.game, HashNNet(self.game), self.args)
+            self.assertTrue(mcts.applyInPlace)
+            mcts.applyInPlace = applyInPlace
+            probs.append(mcts.getActionProb(board))
+
+        self.assertEqual(probs[0], probs[1])
+        self.assertEqual(fen, board.fen())
+        self.assertEqual(stack, board.move_stack)
+
+    def test_episode_records_full_search_moves_only(self):
+        # fool's mate, with the moves of black given on the canonical (mirrored) board
+        moves = ['f2f3', 'e2e4', 'g2g4', 'd1h5']
+        args = dotdict({'tempThreshold': 15, 'playoutCapProb': 0.5, 'numMCTSSimsFast': 2, 'sampleSymmetries': True})
+        coach = Coach(self.game, HashNNet(self.game), args)
+        searched, pis = [], []
+        with mock.patch('numpy.random.random', side_effect=[0.1, 0.9, 0.9, 0.1]):
+            episode = coach.playEpisode()
+            request = next(episode)
+            try:
+                for move in moves:
+                    canonicalBoard, temp, numSims = request
+                    searched.append((canonicalBoard.copy(), numSims))
+                    pi = np.zeros(self.game.getActionSize())
+                    pi[chess.parse_square(move[:2]) * 64 + chess.parse_square(move[2:])] = 1
+                    pis.append(pi)
+                    request = episode.send(pi)
+                self.fail('the episode did not end with the mate')
+            except StopIteration as done:
+                examples = done.value
+
+        self.assertEqual([None, 2, 2, None], [numSims for _, numSims in searched])
+        # the first move of white and the mating move of black
+        self.assertEqual(2, len(examples))
+        for (board, pi, v), i, value in zip(examples, [0, 3], [-1, 1]):
+            np.testing.assert_array_equal(encode_board(searched[i][0]), board)
+            np.testing.assert_array_equal(pis[i], pi)
+            self.assertEqual(value, v)
+
+    def test_resumes_history_across_checkpoint_folders(self):
+        def resume(loadFolder, checkpoint, iterations):
+            args = dotdict({'numItersForTrainExamplesHistory': 4, 'checkpoint': checkpoint,
+                            'load_folder_file': (loadFolder, 'best.pth.tar')})
+            coach = Coach(self.game, HashNNet(self.game), args)
+            if loadFolder is not None:
+                coach.loadTrainExamples()
+            for i in iterations:
+                board = encode_board(self.game.getInitBoard())
+                coach.trainExamplesHistory.addIteration([(board, np.eye(self.game.getActionSize())[i], 1.)])
+                coach.saveTrainExamples(i)
+            return coach.trainExamplesHistory
+
+        with tempfile.TemporaryDirectory() as root:
+            first, second, third = [os.path.join(root, name) for name in ('first', 'second', 'third')]
+            resume(None, first, [0, 1])
+            resume(first, second, [2])
+            history = resume(second, third, [3])
+
+            self.assertEqual(4, history.numIterations())
+            self.assertEqual([0, 1, 2, 3], [int(np.argmax(pi)) for _, pi, _ in history])
+
+    def test_lockstep_self_play_batches_games(self):
+        nnet = HashNNet(self.game)
+        args = dotdict({'numMCTSSims': 4, 'cpuct': 1.0, 'tempThreshold': 15, 'selfPlayBatchSize': 2})
+        examples = Coach(self.game, nnet, args).executeEpisodesLockstep(2)
+
+        self.assertGreater(len(examples), 0)
+        self.assertEqual(2, max(nnet.batch_sizes))
+
+    def test_parallel_self_play_collects_all_episodes(self):
+        args = dotdict({'numMCTSSims': 4, 'cpuct': 1.0, 'tempThreshold': 15, 'numSelfPlayWorkers': 2,
+                        'checkpoint': tempfile.mkdtemp()})
+        coach = Coach(self.game, HashNNet(self.game), args)
+        try:
+            examples = coach.executeEpisodesParallel(2)
+        finally:
+            coach.closeSelfPlay()
+
+        self.assertGreater(len(examples), 0)
+        self.assertEqual(len(examples), coach.selfPlayMetrics.searches)
+
+    def test_parallel_arena_plays_all_games(self):
+        args = dotdict({'numMCTSSims': 4, 'cpuct': 1.0, 'checkpoint': tempfile.mkdtemp()})
+        makePlayers = functools.partial(_arenaPlayers, nnetClass=HashNNet, args=args,
+                                        filenames=('temp.pth.tar', 'arena.pth.tar'))
+        oneWon, twoWon, draws = Arena(None, None, self.game, makePlayers=makePlayers).playGames(4, numWorkers=2)
+
+        self.assertEqual(4, oneWon + twoWon + draws)
+
+    def test_repeated_board_ends_descent_as_draw(self):
+        # the rook and the king shuttle back and forth: the fifth board repeats the root, only the move
+        # counters differ, which the key ignores
+        root = chess.Board('4k3/8/8/8/8/8/8/R3K3 w - - 0 1')
+        mcts = MCTS(self.game, HashNNet(self.game), dotdict({'numMCTSSims': 1, 'cpuct': 1.0}))
+        board = root
+        for action in [8, 4 * 64 + 3, 8 * 64, 3 * 64 + 4]:
+            pi = np.zeros(self.game.getActionSize())
+            pi[action] = 1
+            mcts._expand(mcts.hashKey(board), board, pi, 0.)
+            board, player = self.game.getNextState(board, 1, action)
+            board = self.game.getCanonicalForm(board, player)
+        self.assertEqual(mcts.hashKey(root), mcts.hashKey(board))
+
+        mcts.search(root)
+        node = mcts.nodes[mcts.hashKey(root)]
+        self.assertEqual(1, node.n)
+        self.assertEqual(self.game.getDrawValue(), node.Q[list(node.actions).index(8)])
+
+        probs = MCTS(self.game, HashNNet(self.game), dotdict({'numMCTSSims': 3000, 'cpuct': 1.0})).getActionProb(root)
+        self.assertAlmostEqual(1, sum(probs))
+
+
+if __name__ == '__main__':
+    unittest.main()
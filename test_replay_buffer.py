@@ -0,0 +1,197 @@
+"""
+Unit tests for ReplayBuffer and ExampleShards.
+
+To run tests:
+pytest test_replay_buffer.py
+"""
+
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from ExampleShards import ExampleShards
+from ReplayBuffer import ReplayBuffer
+
+
+def makeExamples(first, n):
+    """
+    Returns n examples whose board, pi and v all hold their number, counting
+    from first.
+    """
+    return [(np.full((2, 3), (first + i) % 100, dtype=np.int64), np.full(4, first + i, dtype=np.float64),
+             float(first + i)) for i in range(n)]
+
+
+class FlipGame():
+    """
+    A stand-in game whose symmetries are the board and pi as they are, and
+    both flipped left to right.
+    """
+
+    def getSymmetries(self, board, pi):
+        return [(board, pi), (np.fliplr(board), pi[::-1])]
+
+
+class TestReplayBuffer(unittest.TestCase):
+
+    def test_keeps_latest_iterations_in_window(self):
+        buffer = ReplayBuffer(100, window=2)
+        buffer.addIteration(makeExamples(0, 10))
+        buffer.addIteration(makeExamples(10, 5))
+        buffer.addIteration(makeExamples(15, 7))
+
+        self.assertEqual(2, buffer.numIterations())
+        self.assertEqual(12, len(buffer))
+        self.assertEqual(list(range(10, 22)), [v for _, _, v in buffer])
+
+    def test_overwrites_oldest_examples_beyond_capacity(self):
+        buffer = ReplayBuffer(8)
+        buffer.addIteration(makeExamples(0, 5))
+        buffer.addIteration(makeExamples(5, 6))
+
+        self.assertEqual(8, len(buffer))
+        self.assertEqual(list(range(3, 11)), [v for _, _, v in buffer])
+        boards, pis, vs = buffer.arrays()
+        self.assertEqual(np.int8, boards.dtype)
+        self.assertEqual(sorted(vs.tolist()), list(range(3, 11)))
+        self.assertTrue(np.array_equal(boards[:, 0, 0], vs))
+
+    def test_sample_matches_stored_examples(self):
+        buffer = ReplayBuffer(8)
+        buffer.addIteration(makeExamples(0, 11))
+        boards, pis, vs = buffer.sample(32)
+
+        self.assertEqual((32, 2, 3), boards.shape)
+        self.assertEqual(np.float32, pis.dtype)
+        self.assertTrue(np.all(vs >= 3))
+        self.assertTrue(np.array_equal(pis[:, 0], vs))
+
+    def test_applies_game_symmetries_when_reading(self):
+        buffer = ReplayBuffer(100, game=FlipGame())
+        board = np.array([[1, 0, -1], [0, 1, 0]])
+        pi = np.array([.5, .25, .25, 0])
+        buffer.addIteration([(board, pi, 1.)] * 50)
+        self.assertEqual(50, len(buffer))
+
+        for boards, pis, _ in [buffer.sample(8) for _ in range(20)] + [buffer.arrays()]:
+            flipped = np.all(boards == np.fliplr(board), axis=(1, 2))
+            self.assertTrue(np.all(flipped | np.all(boards == board, axis=(1, 2))))
+            self.assertTrue(np.array_equal(pis[flipped], np.tile(pi[::-1], (flipped.sum(), 1))))
+        boards, _, _ = buffer.arrays()
+        self.assertTrue(0 < np.all(boards == board, axis=(1, 2)).sum() < 50)
+
+    def test_deduplicated_averages_repeated_boards(self):
+        buffer = ReplayBuffer(100, window=2)
+        buffer.addIteration(makeExamples(0, 3) + makeExamples(100, 2))
+        buffer.addIteration(makeExamples(200, 1))
+        merged = buffer.deduplicated()
+
+        self.assertEqual(6, len(buffer))
+        self.assertEqual(3, len(merged))
+        byBoard = {int(board[0, 0]): (pi, v, count) for (board, pi, v), count in zip(merged, merged.counts)}
+        self.assertEqual({0, 1, 2}, set(byBoard))
+        self.assertEqual((100., 3), byBoard[0][1:])
+        self.assertTrue(np.allclose(byBoard[0][0], 100))
+        self.assertEqual((51., 2), byBoard[1][1:])
+        self.assertEqual((2., 1), byBoard[2][1:])
+
+    def test_deduplicated_examples_are_weighed_by_counts(self):
+        buffer = ReplayBuffer(100)
+        buffer.addIteration(makeExamples(0, 1) * 3 + makeExamples(1, 1))
+        merged = buffer.deduplicated()
+
+        boards, _, _ = merged.arrays()
+        weights = dict(zip(boards[:, 0, 0].tolist(), merged.weights().tolist()))
+        self.assertEqual({0: 1.5, 1: 0.5}, weights)
+        self.assertIsNone(buffer.weights())
+        np.random.seed(0)
+        boards, _, _ = merged.sample(4000)
+        self.assertAlmostEqual(0.75, np.mean(boards[:, 0, 0] == 0), delta=0.03)
+
+    def test_compact_storage_decodes_examples_as_added(self):
+        rng = np.random.RandomState(0)
+        boards = rng.randint(-1, 2, size=(30, 6, 8, 8)).astype(np.int8)
+        pis = np.zeros((30, 4096))
+        for i in range(30):
+            pis[i, rng.choice(4096, size=1 + i % 5, replace=False)] = 1 / (1 + i % 5)
+        buffer = ReplayBuffer(20, compact=True)
+        buffer.addIteration(list(zip(boards[:10], pis[:10] * (np.arange(10) < 3).reshape(-1, 1), range(10))))
+        buffer.addIteration(list(zip(boards[10:], pis[10:], range(10, 30))))
+
+        self.assertTrue(buffer.compact)
+        self.assertEqual(np.uint8, buffer.boards.dtype)
+        self.assertEqual(5, buffer.piIndices.shape[1])
+        for board, pi, v in buffer:
+            self.assertTrue(np.array_equal(boards[int(v)], board))
+            self.assertTrue(np.allclose(pis[int(v)], pi, atol=1e-3))
+        sampledBoards, sampledPis, vs = buffer.sample(16)
+        self.assertEqual((16, 4096), sampledPis.shape)
+        self.assertTrue(np.array_equal(boards[vs.astype(int)], sampledBoards))
+
+        restored = pickle.loads(pickle.dumps(buffer))
+        self.assertTrue(np.array_equal(buffer.arrays()[0], restored.arrays()[0]))
+
+    def test_decodes_and_merges_in_chunks(self):
+        rng = np.random.RandomState(1)
+        distinct = rng.randint(-1, 2, size=(7, 2, 3)).astype(np.int8)
+        which = rng.randint(7, size=30)
+        pis = np.zeros((30, 50))
+        for i in range(30):
+            # action 0 is also where the sparse policies are padded
+            pis[i, [0] + list(rng.choice(np.arange(1, 50), size=i % 4, replace=False))] = 1 / (1 + i % 4)
+        examples = list(zip(distinct[which], pis, which.astype(float)))
+
+        with mock.patch('ExampleCodec.CHUNK_SIZE', 4), mock.patch('ReplayBuffer.CHUNK_SIZE', 4):
+            for compact in [False, True]:
+                buffer = ReplayBuffer(30, compact=compact)
+                buffer.addIteration(examples[:3])
+                buffer.addIteration(examples[3:])
+                self.assertEqual(compact, buffer.compact)
+                boards, storedPis, vs = buffer.arrays()
+                self.assertEqual(np.float16, storedPis.dtype)
+                self.assertTrue(np.allclose(pis, storedPis, atol=1e-3))
+
+                merged = buffer.deduplicated()
+                self.assertEqual(len(np.unique(which)), len(merged))
+                for (board, pi, v), count in zip(merged, merged.counts):
+                    same = which == int(v)
+                    self.assertTrue(np.array_equal(distinct[int(v)], board))
+                    self.assertEqual(same.sum(), count)
+                    self.assertTrue(np.allclose(pis[same].mean(axis=0), pi, atol=1e-3))
+
+    def test_pickles_held_examples_only(self):
+        buffer = ReplayBuffer(1000, window=3)
+        buffer.addIteration(makeExamples(0, 10))
+        restored = pickle.loads(pickle.dumps(buffer))
+
+        self.assertLess(len(pickle.dumps(buffer)), 1000)
+        self.assertEqual([v for _, _, v in buffer], [v for _, _, v in restored])
+        restored.addIteration(makeExamples(10, 5))
+        self.assertEqual(15, len(restored))
+
+
+class TestExampleShards(unittest.TestCase):
+
+    def test_saves_one_shard_per_iteration_and_loads_the_latest(self):
+        buffer = ReplayBuffer(100, window=2)
+        with tempfile.TemporaryDirectory() as folder:
+            for iteration, (first, n) in enumerate([(0, 4), (4, 3), (7, 5)]):
+                buffer.addIteration(makeExamples(first, n))
+                ExampleShards(folder).append(*buffer.latestIteration(), iteration)
+
+            shards = ExampleShards(folder)
+            self.assertEqual(3, len(shards))
+            self.assertEqual([4, 3, 5], [shard['size'] for shard in shards.shards])
+
+            restored = ReplayBuffer(100, window=2)
+            shards.load(restored, 2)
+            self.assertEqual(2, restored.numIterations())
+            self.assertEqual([v for _, _, v in buffer], [v for _, _, v in restored])
+            self.assertEqual(np.int8, restored.boards.dtype)
+
+
+if __name__ == '__main__':
+    unittest.main()